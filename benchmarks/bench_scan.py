@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.fake_danbooru import FakeDanbooru
+from benchmarks.fake_discord import FakeBot
+from danbooru_vandalism_watch.client import DanbooruClient
+from danbooru_vandalism_watch.mirror import VersionMirror
+from danbooru_vandalism_watch.state import StateStore
+from danbooru_vandalism_watch.vandalism_checker import VandalismChecker
+
+DEFAULT_VOLUMES = (1_000, 10_000, 100_000)
+HISTORY = 1_000
+MIRROR_RETENTION_DAYS = 10 * 365  # the fake's versions are dated from 2025 onwards
+
+
+async def bench_scan(volume: int, latency: float) -> dict[str, float]:
+    # every stream catching up on `volume` new post edits and a tenth as many artist edits
+    fake = FakeDanbooru.synthetic(post_versions=volume, artist_versions=max(volume // 10, 1), history=HISTORY, latency=latency)
+    bot = FakeBot()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cog = VandalismChecker(
+            bot,  # type: ignore[arg-type]
+            danbooru=DanbooruClient(session=fake),
+            state=StateStore(Path(tmp) / "state.sqlite3"),
+            mirror=VersionMirror(Path(tmp) / "history.sqlite3", retention_days=MIRROR_RETENTION_DAYS),
+        )
+        for stream in cog.streams.values():
+            stream.cursor = HISTORY
+
+        tracemalloc.start()
+        started_at = time.perf_counter()
+        # keeps polling while the scheduler says a stream is still behind
+        while any(stream.schedule.due() for stream in cog.streams.values()):
+            await asyncio.gather(*(stream.poll() for stream in cog.streams.values()))
+        elapsed = time.perf_counter() - started_at
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # delivery is rate limited by discord and happens in the background, so only count what was queued
+        alerts = cog.dispatcher.depth
+        await cog.cog_unload()
+
+    assert not bot.owner_alerts, "The scan crashed, check the logs."
+    assert cog.streams["post_versions"].cursor == fake.head("post_versions"), "The scan didn't reach the head."
+
+    return {
+        "volume": volume,
+        "seconds": elapsed,
+        "requests": sum(fake.requests.values()),
+        "peak_mb": peak / 1024 / 1024,
+        "alerts": alerts,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark all streams catching up against a fake danbooru.")
+    parser.add_argument("volumes", type=int, nargs="*", default=DEFAULT_VOLUMES, help="New post edits per interval.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per danbooru request.")
+    args = parser.parse_args()
+
+    print(f"{'edits':>8} {'seconds':>9} {'edits/s':>9} {'requests':>9} {'peak MB':>8} {'alerts':>9}")  # noqa: T201
+    for volume in args.volumes:
+        result = asyncio.run(bench_scan(volume, args.latency))
+        print(  # noqa: T201
+            f"{volume:>8} {result['seconds']:>9.2f} {volume / result['seconds']:>9.0f} "
+            f"{result['requests']:>9} {result['peak_mb']:>8.1f} {result['alerts']:>9}",
+        )
+
+
+if __name__ == "__main__":
+    main()
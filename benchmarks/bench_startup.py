@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.fake_danbooru import FakeDanbooru
+from benchmarks.fake_discord import FakeBot
+from danbooru_vandalism_watch.client import DanbooruClient
+from danbooru_vandalism_watch.mirror import VersionMirror
+from danbooru_vandalism_watch.state import StateStore
+from danbooru_vandalism_watch.vandalism_checker import VandalismChecker
+
+HISTORY = 1_000
+MIRROR_RETENTION_DAYS = 10 * 365  # the fake's versions are dated from 2025 onwards
+
+IMPORT_SNIPPET = """
+import time
+started_at = time.perf_counter()
+import danbooru_vandalism_watch.bot
+import danbooru_vandalism_watch.vandalism_checker
+print(time.perf_counter() - started_at)
+"""
+
+
+def import_seconds() -> float:
+    # has to be a fresh interpreter, everything is already imported in this one
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], capture_output=True, text=True, check=True).stdout  # noqa: S603
+    return float(output.strip().splitlines()[-1])
+
+
+async def time_to_first_scan(ready_delay: float, latency: float, behind: int | None) -> tuple[float, float]:
+    # from cog_load until every stream has finished its first poll, and until they've all reached the head
+    fake = FakeDanbooru.synthetic(post_versions=behind or 0, artist_versions=(behind or 0) // 10, history=HISTORY, latency=latency)
+    bot = FakeBot(ready_delay=ready_delay)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        state = StateStore(Path(tmp) / "state.sqlite3")
+        if behind is not None:
+            for stream in ("post_versions", "artist_versions"):
+                state.set_cursor(stream, HISTORY)
+
+        mirror = VersionMirror(Path(tmp) / "history.sqlite3", retention_days=MIRROR_RETENTION_DAYS)
+        cog = VandalismChecker(bot, danbooru=DanbooruClient(session=fake), state=state, mirror=mirror)  # type: ignore[arg-type]
+
+        started_at = time.perf_counter()
+        await cog.cog_load()
+        while not all(stream.schedule.next_at for stream in cog.streams.values()):  # noqa: ASYNC110
+            await asyncio.sleep(0.005)
+        first_scan = time.perf_counter() - started_at
+        while any(stream.schedule.caught_up_at is None for stream in cog.streams.values()):  # noqa: ASYNC110
+            await asyncio.sleep(0.005)
+        caught_up = time.perf_counter() - started_at
+
+        await cog.cog_unload()
+
+    assert not bot.owner_alerts, "The scan crashed, check the logs."
+    return first_scan, caught_up
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark how long the bot takes to start scanning.")
+    parser.add_argument("--ready-delay", type=float, default=3.0, help="Simulated seconds for the discord gateway to connect.")
+    parser.add_argument("--latency", type=float, default=0.1, help="Simulated seconds per danbooru request.")
+    parser.add_argument("--behind", type=int, default=5_000, help="Versions to catch up on when resuming from a saved cursor.")
+    args = parser.parse_args()
+
+    print(f"imports: {import_seconds():.2f}s")  # noqa: T201
+    print(f"{'start':<24} {'first scan':>11} {'caught up':>10}")  # noqa: T201
+    for label, behind in (("fresh", None), (f"resume, {args.behind} behind", args.behind)):
+        first_scan, caught_up = asyncio.run(time_to_first_scan(args.ready_delay, args.latency, behind=behind))
+        print(f"{label:<24} {first_scan:>10.2f}s {caught_up:>9.2f}s")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
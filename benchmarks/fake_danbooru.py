@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import argparse
+import bisect
+import datetime
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qsl, urlsplit
+
+Row = dict[str, Any]
+
+TAGS = [f"tag_{i}" for i in range(2000)]
+EPOCH = datetime.datetime(2025, 1, 1, tzinfo=datetime.UTC)
+
+
+def _matches_id(value: int, search: str) -> bool:
+    if search.startswith(">"):
+        return value > int(search[1:])
+    if search.startswith("<"):
+        return value < int(search[1:])
+    if ".." in search:
+        low, high = search.split("..")
+        return (not low or value >= int(low)) and (not high or value <= int(high))
+    return str(value) in search.split(",")
+
+
+def _keep(row: Row, filters: dict[str, str]) -> bool:
+    for key, value in filters.items():
+        if key == "id" and not _matches_id(row["id"], value):
+            return False
+        if key == "updater_id_not" and str(row["updater_id"]) in value.split(","):
+            return False
+        if key == "artist_id" and not _matches_id(row["artist"]["id"], value):
+            return False
+        if key == "is_new" and value.lower() in {"false", "0"} and row.get("is_new"):
+            return False
+    return True
+
+
+class FakeDanbooru:
+    # in-memory stand-in for the danbooru api, good enough for the handful of queries the bot does
+    # it quacks like danbooru_api, so it can be handed to DanbooruClient(session=...)
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.tables: dict[str, list[Row]] = {"post_versions": [], "artist_versions": []}
+        self.users: dict[int, Row] = {}
+        self.posts: dict[int, Row] = {}
+        self.requests: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def synthetic(  # noqa: PLR0913
+        cls,
+        post_versions: int,
+        artist_versions: int,
+        history: int = 1000,
+        vandalism_rate: float = 0.01,
+        seed: int = 0,
+        latency: float = 0.0,
+    ) -> FakeDanbooru:
+        # `history` versions of each stream exist before the burst, so cursors and lookbacks have something to find
+        fake = cls(latency=latency)
+        rng = random.Random(seed)
+        users: list[Row] = [
+            {"id": i, "name": f"user_{i}", "level": rng.choice([20, 20, 20, 30, 32]), "level_string": "Member"}
+            for i in range(1, 2001)
+        ]
+
+        fake.users = {user["id"]: user for user in users}
+
+        for version_id in range(1, history + post_versions + 1):
+            vandal = rng.random() < vandalism_rate
+            tags = rng.sample(TAGS, rng.randint(3, 40))
+            removed = rng.sample(TAGS, 25 if vandal else rng.randint(0, 3))
+            post_id = rng.randint(1, max(post_versions // 2, 10))
+            post = fake.posts.setdefault(post_id, {"id": post_id, "is_deleted": rng.random() < 0.02})
+            fake.tables["post_versions"].append({
+                "id": version_id,
+                "post_id": post_id,
+                "updater_id": (user := rng.choice(users))["id"],
+                "updater": user,
+                "post": post,
+                "added_tags": rng.sample(tags, min(len(tags), rng.randint(0, 5))),
+                "removed_tags": removed,
+                "tags": " ".join(tags),
+                "updated_at": (EPOCH + datetime.timedelta(seconds=version_id)).isoformat(),
+                "is_new": False,
+            })
+
+        artists = max(artist_versions // 3, 10)
+        for version_id in range(1, history + artist_versions + 1):
+            artist_id = rng.randint(1, artists)
+            vandal = version_id > history and rng.random() < vandalism_rate
+            updated_at = EPOCH + datetime.timedelta(days=30, seconds=version_id)
+            fake.tables["artist_versions"].append({
+                "id": version_id,
+                "updater_id": (user := rng.choice(users))["id"],
+                "updater": user,
+                "artist": {"id": artist_id, "name": f"artist_{artist_id}", "created_at": EPOCH.isoformat()},
+                "urls": [] if vandal else [f"https://example.com/{artist_id}/{i}" for i in range(rng.randint(1, 4))],
+                "created_at": updated_at.isoformat(),
+                "updated_at": updated_at.isoformat(),
+            })
+        return fake
+
+    @classmethod
+    def from_dumps(cls, latency: float = 0.0, **dumps: Path) -> FakeDanbooru:
+        # dumps are the jsonl files written by `replay --dump`
+        fake = cls(latency=latency)
+        for table, path in dumps.items():
+            with path.open(encoding="utf-8") as dump:
+                fake.tables[table] = sorted((json.loads(line) for line in dump if line.strip()), key=lambda r: r["id"])
+        return fake
+
+    def head(self, table: str) -> int:
+        return self.tables[table][-1]["id"] if self.tables[table] else 0
+
+    def danbooru_request(self, method: str, endpoint: str, params: dict[str, Any] | None = None) -> list[Row]:
+        assert method == "GET", method
+        table = endpoint.removesuffix(".json")
+        with self._lock:
+            self.requests[table] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        params = params or {}
+        if table == "users":
+            return [self.users[int(i)] for i in str(params["search[id]"]).split(",") if int(i) in self.users]
+        if table == "posts":
+            ids = next(t.removeprefix("id:") for t in params["tags"].split() if t.startswith("id:"))
+            return [self.posts[int(i)] for i in ids.split(",") if int(i) in self.posts]
+        return self.search(table, params)
+
+    def search(self, table: str, params: dict[str, Any]) -> list[Row]:
+        rows = self.tables[table]
+        limit = int(params.get("limit", 20))
+        filters = {k.removeprefix("search[").removesuffix("]"): str(v) for k, v in params.items() if k.startswith("search[")}
+
+        page = str(params.get("page", ""))
+        if page.startswith("a"):
+            # oldest first from the cursor, then flipped back to the api's newest first order
+            start = bisect.bisect_right(rows, int(page[1:]), key=lambda r: r["id"])
+            found = list(itertools.islice((row for row in rows[start:] if _keep(row, filters)), limit))
+            return found[::-1]
+
+        before = int(page[1:]) if page.startswith("b") else None
+        found = []
+        for row in reversed(rows):
+            if before is not None and row["id"] >= before:
+                continue
+            if _keep(row, filters):
+                found.append(row)
+                if len(found) >= limit:
+                    break
+        return found
+
+
+class FakeDanbooruHandler(BaseHTTPRequestHandler):
+    fake: FakeDanbooru
+
+    def do_GET(self) -> None:  # noqa: N802
+        url = urlsplit(self.path)
+        endpoint = url.path.strip("/")
+        if endpoint.removesuffix(".json") not in {*self.fake.tables, "users", "posts"}:
+            self.send_error(404)
+            return
+
+        body = json.dumps(self.fake.danbooru_request("GET", endpoint, dict(parse_qsl(url.query)))).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:  # noqa: A002
+        pass
+
+
+def serve(fake: FakeDanbooru, host: str = "127.0.0.1", port: int = 3000) -> ThreadingHTTPServer:
+    handler = type("Handler", (FakeDanbooruHandler,), {"fake": fake})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve fake post_versions.json and artist_versions.json locally.")
+    parser.add_argument("--post-versions", type=int, default=10_000)
+    parser.add_argument("--artist-versions", type=int, default=1_000)
+    parser.add_argument("--post-versions-dump", type=Path, help="Serve this jsonl dump instead of synthetic post versions.")
+    parser.add_argument("--artist-versions-dump", type=Path, help="Serve this jsonl dump instead of synthetic artist versions.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to sleep before answering each request.")
+    parser.add_argument("--port", type=int, default=3000)
+    args = parser.parse_args()
+
+    fake = FakeDanbooru.synthetic(args.post_versions, args.artist_versions, latency=args.latency)
+    dumps = {"post_versions": args.post_versions_dump, "artist_versions": args.artist_versions_dump}
+    for table, rows in FakeDanbooru.from_dumps(**{k: v for k, v in dumps.items() if v}).tables.items():
+        if rows:
+            fake.tables[table] = rows
+
+    server = serve(fake, port=args.port)
+    print(f"Serving fake danbooru on http://127.0.0.1:{args.port}. Ctrl-C to stop.")  # noqa: T201
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
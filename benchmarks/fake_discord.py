@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+from typing import Any
+
+from danboorutools import logger
+
+_message_ids = itertools.count(1)
+
+
+@dataclass
+class FakeMessage:
+    channel: FakeChannel
+    id: int = field(default_factory=lambda: next(_message_ids))
+    embeds: list[Any] = field(default_factory=list)
+    content: str | None = None
+
+    async def edit(self, *, embed: Any = None, embeds: list[Any] | None = None, **_) -> FakeMessage:  # noqa: ANN401
+        self.embeds = embeds if embeds is not None else [embed]
+        self.channel.edits += 1
+        return self
+
+
+class FakeChannel:
+    # records whatever the bot would have posted to discord
+
+    def __init__(self) -> None:
+        self.messages: dict[int, FakeMessage] = {}
+        self.edits = 0
+
+    async def send(self, content: str | None = None, *, embed: Any = None, embeds: list[Any] | None = None, **_) -> FakeMessage:  # noqa: ANN401
+        message = FakeMessage(channel=self, content=content, embeds=embeds if embeds is not None else [embed])
+        self.messages[message.id] = message
+        return message
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return self.messages[message_id]
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        return self.messages[message_id]
+
+
+class FakeBot:
+    # just enough of NNTBot for the cog to run without a discord connection
+    test_mode = False
+
+    def __init__(self, ready_delay: float = 0.0) -> None:
+        self.logger = logger
+        self.channel = FakeChannel()
+        self.owner_alerts: list[str | None] = []
+        self.ready_delay = ready_delay  # how long the gateway takes to connect
+
+    async def wait_until_ready(self) -> None:
+        await asyncio.sleep(self.ready_delay)
+
+    async def alert_owner(self, msg: str | None = None) -> None:
+        self.owner_alerts.append(msg)
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+from dataclasses import dataclass, field
+from typing import Any
+
+from discord import Color, Embed
+
+
+@dataclass
+class Alert:
+    # everything needed to build the embed later, so alerts can wait in the state store until discord takes them
+    kind: str  # "tag" or "artist"
+    vandalism_type: str
+    user_id: int
+    user_name: str
+    user_level_string: str
+    timestamp: int
+    version_ids: list[int] = field(default_factory=list)
+    artist_id: int | None = None
+    artist_name: str | None = None
+    # what the rule saw in each version, by version id, for the triage store
+    features: dict[str, dict[str, Any]] = field(default_factory=dict)
+
+    @property
+    def key(self) -> tuple[str, str, int, int | None]:
+        return (self.kind, self.vandalism_type, self.user_id, self.artist_id)
+
+    @property
+    def index_key(self) -> str:
+        return ":".join(map(str, self.key))
+
+    @property
+    def user_url(self) -> str:
+        return f"https://danbooru.donmai.us/users/{self.user_id}"
+
+    def merge(self, other: Alert) -> Alert:
+        assert self.key == other.key
+        return dataclasses.replace(
+            self,
+            version_ids=sorted({*self.version_ids, *other.version_ids}),
+            timestamp=max(self.timestamp, other.timestamp),
+            features={**self.features, **other.features},
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(dataclasses.asdict(self))
+
+    @classmethod
+    def from_json(cls, data: str) -> Alert:
+        fields = json.loads(data)
+        features = fields.get("features") or {}
+        if not all(isinstance(version_features, dict) for version_features in features.values()):
+            # stored before features were kept per version, those only had the last version's
+            fields["features"] = {str(fields["version_ids"][-1]): features}
+        return cls(**fields)
+
+    def embed(self) -> Embed:
+        if self.kind == "artist":
+            return self.artist_embed()
+        return self.tag_embed()
+
+    def tag_embed(self) -> Embed:
+        total_edit_url = f"https://danbooru.donmai.us/post_versions?search[updater_id]={self.user_id}"
+        timeframe_edits_url = "https://danbooru.donmai.us/post_versions?search[id]=" + ",".join(map(str, self.version_ids))
+        timeframe_edit_link = f"[{len(self.version_ids)} posts]({timeframe_edits_url if len(self.version_ids) < 100 else total_edit_url})"
+
+        embed = Embed(
+            title="Tag Vandalism",
+            color=Color.red(),
+        )
+        embed.add_field(name="Type", value=self.vandalism_type, inline=True)
+        embed.add_field(name="\u200b", value="\u200b")
+        embed.add_field(name="Posts", value=timeframe_edit_link, inline=True)
+        embed.add_field(name="All Edits", value=f"[Link]({total_edit_url})", inline=True)
+        embed.add_field(name="\u200b", value="\u200b")
+        embed.add_field(name="Username", value=f"[{self.user_name}]({self.user_url})", inline=True)
+        embed.add_field(name="ID", value=f"{self.user_id}", inline=True)
+        embed.add_field(name="Role", value=f"{self.user_level_string}", inline=True)
+        embed.add_field(name="When", value=f"<t:{self.timestamp}:R>", inline=False)
+        return embed
+
+    def artist_embed(self) -> Embed:
+        artist_versions_url = f"https://danbooru.donmai.us/artist_versions?search[artist_id]={self.artist_id}"
+
+        embed = Embed(
+            title="Artist Vandalism",
+            color=Color.red(),
+        )
+        embed.add_field(name="Type", value=self.vandalism_type, inline=True)
+        embed.add_field(name="Artist", value=f"[{self.artist_name}]({artist_versions_url})", inline=True)
+        embed.add_field(name="\u200b", value="\u200b")
+        embed.add_field(name="Username", value=f"[{self.user_name}]({self.user_url})", inline=True)
+        embed.add_field(name="ID", value=f"#{self.user_id}", inline=True)
+        embed.add_field(name="Role", value=f"{self.user_level_string}", inline=True)
+        embed.add_field(name="When", value=f"<t:{self.timestamp}:R>", inline=False)
+        return embed
+
+
+def merge_payloads(pending: str, new: str) -> str:
+    # for the state store, which only sees alerts as json
+    return Alert.from_json(pending).merge(Alert.from_json(new)).to_json()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import platform
 import random
@@ -25,6 +26,7 @@ class NNTBot(commands.Bot):
         self.logger = logger
         self.channel_id = int(os.environ["NTTBOT_DISCORD_CHANNEL_ID"])
         self.test_channel_id = int(os.environ["NTTBOT_DISCORD_TEST_CHANNEL_ID"])
+        self.background_tasks: set[asyncio.Task] = set()
 
     @cached_property
     def owner(self) -> discord.User:
@@ -101,7 +103,10 @@ class NNTBot(commands.Bot):
             self.logger.info("<g>Running in prod mode.</g>")
         self.logger.info("-------------------")
 
-        await self.alert_owner("Bot started successfully.")
+        # don't hold up the login for a dm
+        task = asyncio.create_task(self.alert_owner("Bot started successfully."))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
 
     @property
     def channel(self) -> discord.TextChannel:
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import itertools
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Generic, TypeVar
+
+from danboorutools import logger
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from danbooru_vandalism_watch.client import DanbooruClient
+    from danbooru_vandalism_watch.models import UserRecord
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+LOOKUP_CHUNK = 100
+
+
+class TTLCache(Generic[K, V]):
+    # bounded lru where entries also go stale after `ttl` seconds
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _fresh(self, key: K) -> tuple[float, V] | None:
+        if (entry := self.entries.get(key)) is None:
+            return None
+        if entry[0] < time.monotonic():
+            # left in place until the refetch replaces it, another stream might still be reading it
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def get(self, key: K) -> V | None:
+        # stale entries are still returned: staleness only decides what `missing` fetches again,
+        # otherwise an entry could expire between the prefetch and the check that needs it
+        # doesn't count towards the hit rate, which tracks lookups that could have gone to the network
+        if (entry := self.entries.get(key)) is None:
+            return None
+        return entry[1]
+
+    def put(self, key: K, value: V) -> None:
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def missing(self, keys: Iterable[K]) -> list[K]:
+        missing = []
+        for key in set(keys):
+            if self._fresh(key) is None:
+                self.misses += 1
+                missing.append(key)
+            else:
+                self.hits += 1
+        return missing
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class RecordCache:
+    # users and post deletion state for everything in a page, looked up in bulk before the page is checked,
+    # so nothing in the detection loop ever has to go to the network for a single object
+
+    def __init__(
+        self,
+        client: DanbooruClient,
+        max_users: int = 20_000,
+        user_ttl: float = 60 * 60,
+        max_posts: int = 200_000,
+        post_ttl: float = 10 * 60,
+    ) -> None:
+        self.client = client
+        self.users: TTLCache[int, UserRecord] = TTLCache(max_users, user_ttl)
+        self.post_deleted: TTLCache[int, bool] = TTLCache(max_posts, post_ttl)
+
+    async def prefetch(self, user_ids: Iterable[int] = (), post_ids: Iterable[int] = ()) -> None:
+        for chunk in itertools.batched(sorted(self.users.missing(user_ids)), LOOKUP_CHUNK):
+            for user in await self.client.users(chunk):
+                self.users.put(user.id, user)
+
+        for chunk in itertools.batched(sorted(self.post_deleted.missing(post_ids)), LOOKUP_CHUNK):
+            found = await self.client.posts_deleted(chunk)
+            for post_id in chunk:
+                if (is_deleted := found.get(post_id)) is None:
+                    # posts danbooru doesn't return at all are as good as deleted
+                    logger.warning(f"Post #{post_id} wasn't returned by danbooru. Treating it as deleted.")
+                    is_deleted = True
+                self.post_deleted.put(post_id, is_deleted)
+
+    def user(self, user_id: int) -> UserRecord:
+        if (user := self.users.get(user_id)) is None:
+            raise KeyError(f"User #{user_id} wasn't prefetched.")
+        return user
+
+    def is_post_deleted(self, post_id: int) -> bool:
+        if (is_deleted := self.post_deleted.get(post_id)) is None:
+            raise KeyError(f"Post #{post_id} wasn't prefetched.")
+        return is_deleted
+
+    def format_stats(self) -> str:
+        return (
+            f"User cache: {len(self.users)} entries, {self.users.hit_rate:.0%} hit rate "
+            f"({self.users.hits} hits, {self.users.misses} misses). "
+            f"Post cache: {len(self.post_deleted)} entries, {self.post_deleted.hit_rate:.0%} hit rate "
+            f"({self.post_deleted.hits} hits, {self.post_deleted.misses} misses)."
+        )
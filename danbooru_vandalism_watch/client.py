@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import operator
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, TypeVar
+
+from danbooru_vandalism_watch.metrics import DANBOORU_ERRORS, DANBOORU_REQUESTS, DANBOORU_SECONDS
+from danbooru_vandalism_watch.models import ArtistVersionRecord, PostVersionRecord, TagIds, UserRecord
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Awaitable, Callable, Collection
+
+T = TypeVar("T")
+V = TypeVar("V")
+
+# only what the detectors and embeds read, anything about the updater comes from the user cache
+POST_VERSION_FIELDS = "id,post_id,updater_id,added_tags,removed_tags,tags,updated_at"
+ARTIST_VERSION_FIELDS = "id,updater_id,urls,updated_at,artist[id,name,created_at]"
+USER_FIELDS = "id,name,level,level_string"
+
+
+class DanbooruClient:
+    # danbooru_api is a blocking requests session, so every call is pushed to a small thread pool
+    # instead of running inside the event loop, where it would freeze discord heartbeats and buttons
+
+    def __init__(self, max_workers: int | None = None, session: Any = None) -> None:  # noqa: ANN401
+        max_workers = max_workers or int(os.environ.get("NNTBOT_DANBOORU_WORKERS", "4"))
+        self.session = session
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="danbooru")
+        self.tags = TagIds()
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def request(self, endpoint: str, **kwargs) -> Any:  # noqa: ANN401
+        return await self.get(endpoint, include=kwargs)
+
+    async def get(self, endpoint: str, params: dict[str, Any] | None = None, include: dict[str, Any] | None = None) -> Any:  # noqa: ANN401
+        name = endpoint.removesuffix(".json")
+        DANBOORU_REQUESTS.inc(endpoint=name)
+        started_at = time.perf_counter()
+        try:
+            return await self.run(self.blocking_get, endpoint, params or {}, include or {})
+        except Exception:
+            DANBOORU_ERRORS.inc(endpoint=name)
+            raise
+        finally:
+            DANBOORU_SECONDS.observe(time.perf_counter() - started_at, endpoint=name)
+
+    def blocking_get(self, endpoint: str, params: dict[str, Any], include: dict[str, Any]) -> Any:  # noqa: ANN401
+        # the danbooru session drags in most of danboorutools, so it's imported on first use in a worker thread
+        # instead of at startup, where it would hold up the discord login
+        from danboorutools.logical.sessions.danbooru import danbooru_api, kwargs_to_include
+
+        self.session = self.session or danbooru_api
+        return self.session.danbooru_request("GET", endpoint, params={**params, **kwargs_to_include(**include)})
+
+    async def post_versions(self, **kwargs) -> list[PostVersionRecord]:
+        data = await self.request("post_versions.json", **kwargs, only=POST_VERSION_FIELDS)
+        return [PostVersionRecord.from_json(p, self.tags) for p in data]
+
+    async def artist_versions(self, **kwargs) -> list[ArtistVersionRecord]:
+        data = await self.request("artist_versions.json", **kwargs, only=ARTIST_VERSION_FIELDS)
+        return [ArtistVersionRecord.from_json(a) for a in data]
+
+    async def users(self, ids: Collection[int]) -> list[UserRecord]:
+        data = await self.request("users.json", id=",".join(map(str, ids)), limit=len(ids), only=USER_FIELDS)
+        return [UserRecord(**u) for u in data]
+
+    async def posts_deleted(self, ids: Collection[int]) -> dict[int, bool]:
+        params = {"tags": f"id:{','.join(map(str, ids))} status:any", "limit": len(ids), "only": "id,is_deleted"}
+        data = await self.get("posts.json", params=params)
+        return {p["id"]: p["is_deleted"] for p in data}
+
+    async def paginate(  # noqa: PLR0913
+        self,
+        fetch: Callable[..., Awaitable[list[V]]],
+        after: int,
+        limit: int = 1000,
+        key: Callable[[V], int] = operator.attrgetter("id"),
+        max_pages: int | None = None,
+        until: int | None = None,
+        **kwargs,
+    ) -> AsyncIterator[list[V]]:
+        # "a<id>" pages return the `limit` versions right after the cursor instead of the newest ones,
+        # so walking forward from the last processed id never skips anything during edit bursts
+        pages = 0
+        while True:
+            page = await fetch(**kwargs, page=f"a{after}", limit=limit)
+            if not page:
+                return
+
+            page.sort(key=key)
+            if until is not None and key(page[-1]) >= until:
+                if page := [item for item in page if key(item) <= until]:
+                    yield page
+                return
+            yield page
+            pages += 1
+
+            if len(page) < limit or pages == max_pages:
+                return
+            after = key(page[-1])
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING
+
+from danboorutools import logger
+
+from danbooru_vandalism_watch.metrics import RULE_OVER_BUDGET, RULE_SECONDS, RULE_TIMEOUTS
+from danbooru_vandalism_watch.rules import RuleEngine, all_rows
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from danbooru_vandalism_watch.rules import Columns, Rule, RuleSet
+
+# with 0 the rules run on the event loop like before, which is plenty for the threshold rules in rules.toml
+DETECTOR_PROCESSES = int(os.environ.get("NNTBOT_DETECTOR_PROCESSES", "0"))
+
+_engine: RuleEngine  # one per worker process
+
+
+def init_worker(rules_path: Path) -> None:
+    global _engine  # noqa: PLW0603
+    _engine = RuleEngine(rules_path)
+
+
+def select_rows(stream: str, rule_name: str, columns: Columns, candidates: int) -> tuple[int, int]:
+    # the worker keeps its own copy of the rules, so it picks up changes to the file the same way the bot does
+    _engine.reload_if_changed()
+    if (ruleset := _engine.rulesets.get(stream)) is None or (rule := ruleset.rule(rule_name)) is None:
+        return 0, 0
+    started_at = time.perf_counter_ns()
+    matched = rule.select(columns, candidates)
+    return matched, time.perf_counter_ns() - started_at
+
+
+class DetectorPool:
+    # runs the rules over a page of versions, one job per rule, so a slow rule only holds up itself
+    # the features are computed by the streams beforehand, since they depend on the order versions come in
+
+    def __init__(self, rules: RuleEngine, processes: int = DETECTOR_PROCESSES) -> None:
+        self.rules = rules
+        self.processes = processes
+        self.executor: ProcessPoolExecutor | None = None
+
+    def stop(self) -> None:
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def kill(self, executor: ProcessPoolExecutor) -> None:
+        # shutdown() waits for the running jobs to finish, which a runaway rule never does, so the workers get terminated
+        # a new pool is spawned on the next page. every rule that times out on the page ends up here, only the first one kills it
+        if executor._processes is not None:
+            for process in list(executor._processes.values()):
+                process.terminate()
+            executor.shutdown(wait=False, cancel_futures=True)
+        if self.executor is executor:
+            self.executor = None
+
+    async def evaluate(self, stream: str, columns: Columns, size: int) -> list[str | None]:
+        if (ruleset := self.rules.rulesets.get(stream)) is None or not size:
+            return [None] * size
+        if self.processes <= 0:
+            return self.evaluate_inline(stream, ruleset, columns, size)
+
+        if self.executor is None:
+            # the bot has threads and an event loop going, so the workers are spawned instead of forked
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(self.rules.path,),
+            )
+
+        # every rule sees the whole page, and the masks are merged in rule order afterwards
+        # so the result doesn't depend on which worker finished first
+        executor = self.executor
+        candidates = all_rows(size)
+        rules = ruleset.all_rules()
+        results = await asyncio.gather(
+            *(self.evaluate_remote(executor, stream, rule, columns, candidates) for rule in rules),
+            return_exceptions=True,
+        )
+        # jobs lost to a dead pool come back broken, the ones that hadn't been sent to a worker yet come back cancelled
+        lost = [isinstance(result, BrokenProcessPool | asyncio.CancelledError) for result in results]
+        if any(lost):
+            # either a worker died, or the pool was killed to stop a rule that ran past its timeout
+            logger.warning(f"The detector pool went down while checking {stream}. Checking {sum(lost)} rules inline.")
+            if self.executor is executor:
+                self.stop()
+
+        masks: list[int] = []
+        for rule, result, was_lost in zip(rules, results, lost, strict=True):
+            if was_lost:
+                masks.append(self.run_inline(stream, rule, columns, candidates))
+            elif isinstance(result, BaseException):
+                raise result
+            elif result is None and rule is ruleset.skip:
+                # without the skip rules there's no telling which versions are fine, so they're checked again on the loop
+                masks.append(self.run_inline(stream, rule, columns, candidates))
+            else:
+                masks.append(result or 0)
+        skipped, *matches = masks
+        return ruleset.combine(skipped, matches, size)
+
+    def evaluate_inline(self, stream: str, ruleset: RuleSet, columns: Columns, size: int) -> list[str | None]:
+        # can't interrupt a rule running on the loop, so only the budget applies here
+        remaining = all_rows(size)
+        skipped = self.run_inline(stream, ruleset.skip, columns, remaining)
+        remaining &= ~skipped
+        matches = []
+        for rule in ruleset.rules:
+            matched = self.run_inline(stream, rule, columns, remaining) if remaining else 0
+            matches.append(matched)
+            remaining &= ~matched
+        return ruleset.combine(skipped, matches, size)
+
+    def run_inline(self, stream: str, rule: Rule, columns: Columns, candidates: int) -> int:
+        started_at = time.perf_counter_ns()
+        matched = rule.select(columns, candidates)
+        self.account(stream, rule, candidates, matched, time.perf_counter_ns() - started_at)
+        return matched
+
+    async def evaluate_remote(
+        self, executor: ProcessPoolExecutor, stream: str, rule: Rule, columns: Columns, candidates: int,
+    ) -> int | None:
+        # only the columns the rule looks at are sent over
+        needed = {name: columns[name] for name in rule.features() if name in columns}
+        job = asyncio.get_running_loop().run_in_executor(executor, select_rows, stream, rule.name, needed, candidates)
+        try:
+            # includes the wait for a free worker
+            matched, nanoseconds = await asyncio.wait_for(job, rule.timeout_ms / 1000)
+        except TimeoutError:
+            rule.timeouts += 1
+            RULE_TIMEOUTS.inc(stream=stream, rule=rule.name)
+            logger.warning(f"Rule '{rule.name}' on {stream} took longer than {rule.timeout_ms:.0f}ms. Restarting the detector pool.")
+            # the worker keeps going after the future is cancelled, and everything after it would queue up behind it
+            self.kill(executor)
+            return None
+        self.account(stream, rule, candidates, matched, nanoseconds)
+        return matched
+
+    def account(self, stream: str, rule: Rule, candidates: int, matched: int, nanoseconds: int) -> None:
+        rule.record(candidates, matched, nanoseconds)
+        RULE_SECONDS.observe(nanoseconds / 1e9, stream=stream, rule=rule.name)
+        if nanoseconds > rule.budget_ms * 1e6:
+            rule.over_budget += 1
+            RULE_OVER_BUDGET.inc(stream=stream, rule=rule.name)
+            logger.warning(f"Rule '{rule.name}' on {stream} took {nanoseconds / 1e6:.1f}ms, over its {rule.budget_ms:.0f}ms budget.")
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import datetime
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from danbooru_vandalism_watch.windows import DEFAULT_WINDOWS, WindowTotals
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from danbooru_vandalism_watch.cache import RecordCache
+    from danbooru_vandalism_watch.models import ArtistVersionRecord, PostVersionRecord
+    from danbooru_vandalism_watch.windows import UserWindows
+
+BOT_IDS = [
+    "502584",  # danboorubot
+    "865894",  # nntbot
+]
+
+
+class TagEditFeatures(NamedTuple):
+    id: int
+    updater_id: int
+    removed_tags: int
+    added_tags: int
+    tags_after_edit: int
+    updater_level: int
+    post_is_deleted: bool
+    updated_at: float
+
+    @classmethod
+    def from_post_version(cls, post_version: PostVersionRecord, records: RecordCache) -> TagEditFeatures:
+        return cls(
+            id=post_version.id,
+            updater_id=post_version.updater_id,
+            removed_tags=len(post_version.removed_tags),
+            added_tags=len(post_version.added_tags),
+            tags_after_edit=post_version.tag_count,
+            updater_level=records.user(post_version.updater_id).level,
+            post_is_deleted=records.is_post_deleted(post_version.post_id),
+            updated_at=post_version.updated_at,
+        )
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> TagEditFeatures:
+        return cls(
+            id=data["id"],
+            updater_id=data["updater_id"],
+            removed_tags=len(data["removed_tags"]),
+            added_tags=len(data["added_tags"]),
+            tags_after_edit=len(data["tags"].split()),
+            updater_level=data["updater"]["level"],
+            post_is_deleted=data["post"]["is_deleted"],
+            updated_at=datetime.datetime.fromisoformat(data["updated_at"]).timestamp(),
+        )
+
+
+class ArtistEditFeatures(NamedTuple):
+    id: int
+    updater_id: int
+    artist_id: int
+    seconds_since_creation: int  # whole seconds, so `max = 3599` in the rules means under an hour
+    updater_level: int
+    urls: int
+    previous_urls: int | None  # None if there was no previous version
+
+    @classmethod
+    def from_artist_version(
+        cls,
+        artist_version: ArtistVersionRecord,
+        previous_urls: Sequence[str] | None,
+        records: RecordCache,
+    ) -> ArtistEditFeatures:
+        return cls(
+            id=artist_version.id,
+            updater_id=artist_version.updater_id,
+            artist_id=artist_version.artist_id,
+            seconds_since_creation=int(artist_version.updated_at - artist_version.artist_created_at),
+            updater_level=records.user(artist_version.updater_id).level,
+            urls=len(artist_version.urls),
+            previous_urls=None if previous_urls is None else len(previous_urls),
+        )
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any], previous_urls: Sequence[str] | None) -> ArtistEditFeatures:
+        updated_at = datetime.datetime.fromisoformat(data["updated_at"])
+        created_at = datetime.datetime.fromisoformat(data["artist"]["created_at"])
+        return cls(
+            id=data["id"],
+            updater_id=data["updater"]["id"],
+            artist_id=data["artist"]["id"],
+            seconds_since_creation=int((updated_at - created_at).total_seconds()),
+            updater_level=data["updater"]["level"],
+            urls=len(data["urls"]),
+            previous_urls=None if previous_urls is None else len(previous_urls),
+        )
+
+
+def activity_features(totals: WindowTotals, window: str) -> dict[str, Any]:
+    features: dict[str, Any] = {f"{name}_{window}": value for name, value in totals._asdict().items()}
+    if totals.edits_with_removals:
+        features[f"removed_per_edit_{window}"] = totals.removed_tags / totals.edits_with_removals
+    else:
+        features[f"removed_per_edit_{window}"] = 0
+    return features
+
+
+def feature_columns(rows: Sequence[tuple]) -> dict[str, Sequence[Any]]:
+    # a page of feature tuples turned into one column per feature, for RuleEngine.evaluate_batch
+    if not rows:
+        return {}
+    return dict(zip(type(rows[0])._fields, zip(*rows, strict=True), strict=True))  # type: ignore[attr-defined]
+
+
+def tag_edit_columns(
+    rows: Sequence[TagEditFeatures],
+    windows: UserWindows,
+    needed: set[str],
+) -> dict[str, Sequence[Any]]:
+    columns = feature_columns(rows)
+
+    # windows are fed in id order and read right after each edit, so every row sees the activity up to itself
+    # only the windows some rule actually looks at are read back
+    # this records the page before it's been checked, so a page that fails has to start from fresh windows (see forget())
+    wanted = [window for window in windows.windows if any(name.endswith(f"_{window}") for name in needed)]
+    totals: dict[str, list[WindowTotals]] = {window: [] for window in wanted}
+    for row in rows:
+        windows.record(row.updater_id, row.updated_at, row.removed_tags, row.added_tags)
+        for window in wanted:
+            totals[window].append(windows.totals(row.updater_id, window))
+
+    for window, window_totals in totals.items():
+        if not window_totals:
+            continue
+        for name, column in zip(WindowTotals._fields, zip(*window_totals, strict=True), strict=True):
+            columns[f"{name}_{window}"] = column
+        columns[f"removed_per_edit_{window}"] = [
+            t.removed_tags / t.edits_with_removals if t.edits_with_removals else 0 for t in window_totals
+        ]
+    return columns
+
+
+# everything a rule in rules.toml is allowed to look at
+STREAM_FEATURES = {
+    "post_versions": {
+        *TagEditFeatures._fields,
+        *(name for window in DEFAULT_WINDOWS for name in activity_features(WindowTotals(), window)),
+    },
+    "artist_versions": set(ArtistEditFeatures._fields),
+}
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import os
+import random
+import time
+from typing import TYPE_CHECKING
+
+import aiohttp
+import discord
+
+from danbooru_vandalism_watch.alerts import Alert, merge_payloads
+from danbooru_vandalism_watch.metrics import ALERT_QUEUE_DEPTH, ALERT_RETRIES, ALERTS_SENT
+from danbooru_vandalism_watch.view import PersistentView
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+    from danbooru_vandalism_watch.bot import NNTBot
+    from danbooru_vandalism_watch.state import StateStore
+
+MAX_RETRY_DELAY = 5 * 60
+# shard workers write alerts straight into the state store, so it's also checked every so often without a wakeup
+POLL_INTERVAL = 5
+# follow-up detections for the same user and vandalism type edit the open message instead of posting a new one
+MERGE_WINDOW = int(os.environ.get("NNTBOT_ALERT_MERGE_WINDOW", str(60 * 60)))
+
+
+class TokenBucket:
+    def __init__(self, rate: int, per: float) -> None:
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated_at = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate / self.per)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+
+def coalesce(pending: list[tuple[int, Alert]]) -> list[tuple[list[int], Alert]]:
+    # one message per user and vandalism type, no matter how many scans it took to get here
+    # (alerts aren't packed several to a message because the handled/false positive buttons are per message)
+    merged: dict[tuple, tuple[list[int], Alert]] = {}
+    for alert_id, alert in pending:
+        if (existing := merged.get(alert.key)) is None:
+            merged[alert.key] = ([alert_id], alert)
+        else:
+            existing[0].append(alert_id)
+            merged[alert.key] = (existing[0], existing[1].merge(alert))
+    return list(merged.values())
+
+
+class AlertDispatcher:
+    # detections are written to the state store and the scan moves on; a background task delivers them
+    # at the pace discord allows, and anything not yet delivered is still there after a restart
+
+    def __init__(self, bot: NNTBot, state: StateStore, batch_size: int = 50) -> None:
+        self.bot = bot
+        self.state = state
+        self.batch_size = batch_size
+        self.bucket = TokenBucket(rate=5, per=5)  # discord's usual per-channel message limit
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run(), name="alert_dispatcher")
+        self.wakeup.set()  # deliver whatever was left over from the last run
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def submit(self, alert: Alert) -> None:
+        self.state.add_alert(alert.index_key, alert.to_json(), merge_payloads)
+        ALERT_QUEUE_DEPTH.set(self.depth)
+        self.wakeup.set()
+
+    @property
+    def depth(self) -> int:
+        return self.state.count_alerts()
+
+    async def run(self) -> None:
+        await self.bot.wait_until_ready()
+        while True:
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self.wakeup.wait(), timeout=POLL_INTERVAL)
+            self.wakeup.clear()
+            try:
+                await self.drain()
+            except Exception:
+                self.bot.logger.exception("Encountered an exception while sending alerts. Sending to owner...")
+                await self.bot.alert_owner()
+                await asyncio.sleep(60)
+                self.wakeup.set()
+
+    async def drain(self) -> None:
+        self.state.expire_open_alerts(before=time.time() - MERGE_WINDOW)
+        while rows := self.state.pending_alerts(self.batch_size):
+            payloads = dict(rows)
+            for alert_ids, alert in coalesce([(alert_id, Alert.from_json(payload)) for alert_id, payload in rows]):
+                await self.deliver(alert)
+                self.state.remove_alerts([(alert_id, payloads[alert_id]) for alert_id in alert_ids])
+                ALERT_QUEUE_DEPTH.set(self.depth)
+
+    async def deliver(self, alert: Alert) -> None:
+        try:
+            await self.publish(alert)
+        except discord.HTTPException:
+            self.bot.logger.exception(f"Discord refused alert for user #{alert.user_id}. Dropping it.")
+
+    async def publish(self, alert: Alert) -> None:
+        if open_alert := self.state.get_open_alert(alert.index_key, since=time.time() - MERGE_WINDOW):
+            message_id, payload = open_alert
+            merged = Alert.from_json(payload).merge(alert)
+            message = self.bot.channel.get_partial_message(message_id)
+            try:
+                await self.with_retries(lambda: message.edit(embed=merged.embed()))
+            except discord.NotFound:
+                self.state.close_alert(message_id)  # somebody deleted it, post a fresh one
+            else:
+                self.bot.logger.info(f"Updated open alert {message_id} for user #{alert.user_id}.")
+                self.state.set_open_alert(alert.index_key, message_id, merged.to_json())
+                self.state.record_sent_alert(message_id, merged.vandalism_type, merged.to_json())
+                return
+
+        message = await self.with_retries(lambda: self.bot.channel.send(embed=alert.embed(), view=PersistentView()))
+        self.state.set_open_alert(alert.index_key, message.id, alert.to_json())
+        self.state.record_sent_alert(message.id, alert.vandalism_type, alert.to_json())
+
+    async def with_retries(self, call: Callable[[], Awaitable[discord.Message]]) -> discord.Message:
+        delay = 1.0
+        while True:
+            await self.bucket.acquire()
+            try:
+                message = await call()
+            except discord.HTTPException as e:
+                if e.status != 429 and e.status < 500:
+                    raise
+                self.bot.logger.warning(f"Discord returned {e.status} while sending an alert. Retrying in {delay:.0f}s...")
+            except (OSError, aiohttp.ClientError, TimeoutError):
+                self.bot.logger.warning(f"Couldn't reach discord while sending an alert. Retrying in {delay:.0f}s...")
+            else:
+                ALERTS_SENT.inc()
+                return message
+
+            ALERT_RETRIES.inc()
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, MAX_RETRY_DELAY)
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import itertools
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
+
+    from danbooru_vandalism_watch.client import DanbooruClient
+    from danbooru_vandalism_watch.mirror import VersionMirror
+
+PREFETCH_CHUNK = 100
+
+
+class ArtistUrlIndex:
+    # last known urls for each artist, kept up to date by whoever walks the artist version stream
+    # None means the artist had no versions before the ones we're looking at
+
+    def __init__(self, max_size: int = 10_000) -> None:
+        self.max_size = max_size
+        self.urls: OrderedDict[int, Sequence[str] | None] = OrderedDict()
+
+    def __contains__(self, artist_id: int) -> bool:
+        return artist_id in self.urls
+
+    def get(self, artist_id: int) -> Sequence[str] | None:
+        return self.urls.get(artist_id)
+
+    def remember(self, artist_id: int, urls: Sequence[str] | None) -> None:
+        self.urls[artist_id] = urls
+        self.urls.move_to_end(artist_id)
+        while len(self.urls) > self.max_size:
+            self.urls.popitem(last=False)
+
+    async def prefetch(self, client: DanbooruClient, artist_ids: Iterable[int], after: int, mirror: VersionMirror | None = None) -> None:
+        # urls as of version `after`, the one right before the page about to be checked
+        missing = sorted({artist_id for artist_id in artist_ids if artist_id not in self})
+
+        if mirror is not None:
+            for chunk in itertools.batched(missing, PREFETCH_CHUNK):
+                for artist_id, urls in (await mirror.previous_artist_urls(chunk, after)).items():
+                    self.remember(artist_id, urls)
+            missing = [artist_id for artist_id in missing if artist_id not in self]
+
+        for chunk in itertools.batched(missing, PREFETCH_CHUNK):
+            previous_versions = await client.artist_versions(artist_id=",".join(map(str, chunk)), id=f"..{after}", limit=1000)
+            latest: dict[int, Sequence[str]] = {}
+            for previous_version in previous_versions:  # newest first
+                latest.setdefault(previous_version.artist_id, previous_version.urls)
+
+            for artist_id in chunk:
+                if artist_id not in latest and len(previous_versions) >= 1000:
+                    # crowded out by artists with long histories, ask for this one alone
+                    single = await client.artist_versions(artist_id=artist_id, id=f"..{after}", limit=1)
+                    if single:
+                        latest[artist_id] = single[0].urls
+                self.remember(artist_id, latest.get(artist_id))
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import TypeVar
+
+from danboorutools import logger
+
+M = TypeVar("M", bound="Metric")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# scrapers that connect and then never finish their request get dropped after this many seconds
+READ_TIMEOUT = 5
+
+
+def format_labels(labels: tuple[tuple[str, str], ...], **extra: str) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def summary(self) -> list[str]: ...
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str) -> None:
+        super().__init__(name, description)
+        self.values: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels.items())
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        return [*super().render(), *(f"{self.name}{format_labels(labels)} {value:g}" for labels, value in self.values.items())]
+
+    def summary(self) -> list[str]:
+        return [f"{self.name}{format_labels(labels)} {value:g}" for labels, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[tuple(labels.items())] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, description)
+        self.buckets = buckets
+        # per label set: count per bucket (the last one is +Inf), total count, sum and max
+        self.values: dict[tuple[tuple[str, str], ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels.items())
+        if (entry := self.values.get(key)) is None:
+            entry = self.values[key] = ([0] * (len(self.buckets) + 1), [0, 0.0, 0.0])
+        counts, totals = entry
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        totals[0] += 1
+        totals[1] += value
+        totals[2] = max(totals[2], value)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, (counts, (count, total, _)) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts, strict=True):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(labels, le=str(bound))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total:g}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count:g}")
+        return lines
+
+    def summary(self) -> list[str]:
+        return [
+            f"{self.name}{format_labels(labels)} n={count:g} avg={total / count:.3f} max={maximum:.3f}"
+            for labels, (_, (count, total, maximum)) in self.values.items()
+            if count
+        ]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: M) -> M:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+    def summary(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.summary())
+
+
+REGISTRY = Registry()
+
+SCAN_SECONDS = REGISTRY.register(Histogram("nntbot_scan_seconds", "Time taken by one poll of a stream."))
+VERSIONS = REGISTRY.register(Counter("nntbot_versions_total", "Versions checked."))
+VERSIONS_PER_SECOND = REGISTRY.register(Gauge("nntbot_versions_per_second", "Versions checked per second during the last poll."))
+CURSOR_LAG_VERSIONS = REGISTRY.register(Gauge("nntbot_cursor_lag_versions", "Newest version id minus the last checked one."))
+CURSOR_LAG_SECONDS = REGISTRY.register(
+    Gauge("nntbot_cursor_lag_seconds", "How old the last checked version was when a poll ended behind the head."),
+)
+DETECTIONS = REGISTRY.register(Counter("nntbot_detections_total", "Versions detected as vandalism, per rule."))
+SUPPRESSED = REGISTRY.register(Counter("nntbot_suppressed_total", "Detections dropped because they match known false positives."))
+RULE_SECONDS = REGISTRY.register(
+    Histogram("nntbot_rule_seconds", "Time taken by one rule on one page of versions.", buckets=(0.0001, 0.001, 0.01, 0.1, 0.5, 1, 5)),
+)
+RULE_OVER_BUDGET = REGISTRY.register(Counter("nntbot_rule_over_budget_total", "Pages on which a rule took longer than its budget."))
+RULE_TIMEOUTS = REGISTRY.register(Counter("nntbot_rule_timeouts_total", "Pages on which a rule timed out and its matches were dropped."))
+
+DANBOORU_REQUESTS = REGISTRY.register(Counter("nntbot_danbooru_requests_total", "Requests sent to danbooru."))
+DANBOORU_ERRORS = REGISTRY.register(Counter("nntbot_danbooru_errors_total", "Requests to danbooru that failed."))
+DANBOORU_SECONDS = REGISTRY.register(
+    Histogram("nntbot_danbooru_request_seconds", "Danbooru request latency, including the wait for a worker."),
+)
+
+ALERTS_SENT = REGISTRY.register(Counter("nntbot_alerts_sent_total", "Alerts posted or edited on discord."))
+ALERT_RETRIES = REGISTRY.register(Counter("nntbot_alert_retries_total", "Discord sends that had to be retried."))
+ALERT_QUEUE_DEPTH = REGISTRY.register(Gauge("nntbot_alert_queue_depth", "Alerts waiting to be sent to discord."))
+
+EVENT_LOOP_LAG = REGISTRY.register(
+    Histogram("nntbot_event_loop_lag_seconds", "How late the event loop woke up a sleeping task.", buckets=(0.001, 0.01, 0.1, 0.5, 1, 5)),
+)
+
+
+async def watch_event_loop(interval: float = 0.5) -> None:
+    # anything blocking the loop (sync sqlite, rule evaluation on huge pages...) shows up as a late wakeup
+    while True:
+        started_at = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(time.perf_counter() - started_at - interval, 0))
+
+
+class MetricsServer:
+    # bare bones http endpoint for prometheus to scrape, disabled unless NNTBOT_METRICS_PORT is set
+
+    def __init__(self, port: int | None = None, host: str | None = None) -> None:
+        port_setting = port or os.environ.get("NNTBOT_METRICS_PORT")
+        self.port = int(port_setting) if port_setting else None
+        self.host = host or os.environ.get("NNTBOT_METRICS_HOST", "127.0.0.1")
+        self.server: asyncio.Server | None = None
+        self.loop_watcher: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self.loop_watcher = asyncio.create_task(watch_event_loop(), name="event_loop_watcher")
+        if self.port is None:
+            return
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self.loop_watcher:
+            self.loop_watcher.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                request_line = await asyncio.wait_for(self.read_request_line(reader), READ_TIMEOUT)
+            except (TimeoutError, ConnectionError, ValueError):
+                return
+            path = request_line.split(b" ")[1] if request_line.count(b" ") >= 2 else b""
+
+            if path.split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", REGISTRY.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found.\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body,
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def read_request_line(self, reader: asyncio.StreamReader) -> bytes:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass  # headers don't matter
+        return request_line
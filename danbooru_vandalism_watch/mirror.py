@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import array
+import asyncio
+import functools
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, NamedTuple, TypeVar
+
+from danbooru_vandalism_watch.models import ArtistVersionRecord
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Sequence
+
+    from danbooru_vandalism_watch.models import PostVersionRecord, TagIds
+
+T = TypeVar("T")
+
+DAY = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS post_versions (
+    id INTEGER PRIMARY KEY,
+    day INTEGER NOT NULL,
+    post_id INTEGER NOT NULL,
+    updater_id INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    tag_count INTEGER NOT NULL,
+    added BLOB NOT NULL,  -- tag ids packed as unsigned ints
+    removed BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS post_versions_post ON post_versions (post_id, id);
+CREATE INDEX IF NOT EXISTS post_versions_updater ON post_versions (updater_id, id);
+CREATE INDEX IF NOT EXISTS post_versions_day ON post_versions (day);
+
+CREATE TABLE IF NOT EXISTS artists (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS artist_versions (
+    id INTEGER PRIMARY KEY,
+    day INTEGER NOT NULL,
+    artist_id INTEGER NOT NULL,
+    updater_id INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    urls TEXT NOT NULL  -- newline separated
+);
+CREATE INDEX IF NOT EXISTS artist_versions_artist ON artist_versions (artist_id, id);
+CREATE INDEX IF NOT EXISTS artist_versions_updater ON artist_versions (updater_id, id);
+CREATE INDEX IF NOT EXISTS artist_versions_day ON artist_versions (day);
+
+-- the stretch of a stream that was mirrored without gaps, ids in (start_id, end_id]
+CREATE TABLE IF NOT EXISTS coverage (
+    stream TEXT PRIMARY KEY,
+    start_id INTEGER NOT NULL,
+    end_id INTEGER NOT NULL
+);
+"""
+
+
+class MirroredPostVersion(NamedTuple):
+    id: int
+    post_id: int
+    updater_id: int
+    added_tags: list[str]
+    removed_tags: list[str]
+    tag_count: int
+    updated_at: float
+
+    @property
+    def url(self) -> str:
+        return f"https://danbooru.donmai.us/post_versions/{self.id}"
+
+
+def pack(tag_ids: Sequence[int]) -> bytes:
+    return array.array("I", tag_ids).tobytes()
+
+
+def unpack(packed: bytes) -> array.array:
+    tag_ids = array.array("I")
+    tag_ids.frombytes(packed)
+    return tag_ids
+
+
+class VersionMirror:
+    # every version the streams check, kept locally so "what did this look like before" doesn't need danbooru
+    # tag names are stored once and versions only keep their ids, and rows are bucketed by day so retention is one delete
+    # all of the sqlite work happens on one thread of its own, so writes and the daily expiry never hold up the event loop
+
+    def __init__(self, path: str | Path | None = None, retention_days: int | None = None) -> None:
+        if retention_days is None:
+            retention_days = int(os.environ.get("NNTBOT_MIRROR_RETENTION_DAYS", "30"))
+        self.retention_days = retention_days
+        self.enabled = retention_days > 0
+        self.expired_through = 0
+
+        self.path = Path(path or os.environ.get("NNTBOT_MIRROR_PATH", "data/history.sqlite3"))
+        if not self.enabled:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mirror")
+        # only ever used from the executor's thread after this
+        self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.tag_ids: dict[str, int] = dict(self.connection.execute("SELECT name, id FROM tags"))
+        self.tag_names = {tag_id: name for name, tag_id in self.tag_ids.items()}
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:  # noqa: ANN401
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+    def intern(self, names: Sequence[str]) -> list[int]:
+        if new := {name for name in names if name not in self.tag_ids}:
+            self.connection.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(name,) for name in new])
+            placeholders = ",".join("?" * len(new))
+            for name, tag_id in self.connection.execute(f"SELECT name, id FROM tags WHERE name IN ({placeholders})", tuple(new)):  # noqa: S608
+                self.tag_ids[name] = tag_id
+                self.tag_names[tag_id] = name
+        return [self.tag_ids[name] for name in names]
+
+    def cover(self, stream: str, after: int, last_id: int) -> None:
+        # a page that picks up where the mirrored stretch ends extends it, anything else starts a new one
+        self.connection.execute(
+            "INSERT INTO coverage (stream, start_id, end_id) VALUES (?, ?, ?) "
+            "ON CONFLICT (stream) DO UPDATE SET "
+            "start_id = CASE WHEN end_id = ? THEN start_id ELSE excluded.start_id END, end_id = excluded.end_id",
+            (stream, after, last_id, after),
+        )
+
+    # `after` is the id each page was fetched after, to tell whether it follows on from what's already mirrored
+
+    async def append_post_versions(self, versions: Sequence[PostVersionRecord], after: int, tags: TagIds) -> None:
+        if not self.enabled or not versions:
+            return
+        # the client's tag table can be trimmed between pages, so the names are read before leaving the loop
+        named = [(version, tags.lookup(version.added_tags), tags.lookup(version.removed_tags)) for version in versions]
+        await self.run(self.write_post_versions, named, after)
+
+    def write_post_versions(self, named: list[tuple[PostVersionRecord, list[str], list[str]]], after: int) -> None:
+        with self.connection:
+            rows = [
+                (
+                    version.id,
+                    int(version.updated_at // DAY),
+                    version.post_id,
+                    version.updater_id,
+                    version.updated_at,
+                    version.tag_count,
+                    pack(self.intern(added)),
+                    pack(self.intern(removed)),
+                )
+                for version, added, removed in named
+            ]
+            self.connection.executemany("INSERT OR REPLACE INTO post_versions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.cover("post_versions", after, named[-1][0].id)
+        self.expire()
+
+    async def append_artist_versions(self, versions: Sequence[ArtistVersionRecord], after: int) -> None:
+        if not self.enabled or not versions:
+            return
+        await self.run(self.write_artist_versions, versions, after)
+
+    def write_artist_versions(self, versions: Sequence[ArtistVersionRecord], after: int) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO artists VALUES (?, ?, ?)",
+                {(v.artist_id, v.artist_name, v.artist_created_at) for v in versions},
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO artist_versions VALUES (?, ?, ?, ?, ?, ?)",
+                [(v.id, int(v.updated_at // DAY), v.artist_id, v.updater_id, v.updated_at, "\n".join(v.urls)) for v in versions],
+            )
+            self.cover("artist_versions", after, versions[-1].id)
+        self.expire()
+
+    def expire(self) -> None:
+        oldest_day = int(time.time() // DAY) - self.retention_days
+        if oldest_day <= self.expired_through:
+            return
+        with self.connection:
+            self.connection.execute("DELETE FROM post_versions WHERE day < ?", (oldest_day,))
+            self.connection.execute("DELETE FROM artist_versions WHERE day < ?", (oldest_day,))
+            self.connection.execute("DELETE FROM artists WHERE id NOT IN (SELECT artist_id FROM artist_versions)")
+        self.expired_through = oldest_day
+
+    def decode_post_version(self, row: tuple) -> MirroredPostVersion:
+        version_id, post_id, updater_id, updated_at, tag_count, added, removed = row
+        return MirroredPostVersion(
+            id=version_id,
+            post_id=post_id,
+            updater_id=updater_id,
+            added_tags=[self.tag_names[tag_id] for tag_id in unpack(added)],
+            removed_tags=[self.tag_names[tag_id] for tag_id in unpack(removed)],
+            tag_count=tag_count,
+            updated_at=updated_at,
+        )
+
+    async def post_versions(
+        self,
+        post_id: int | None = None,
+        updater_id: int | None = None,
+        before: int | None = None,
+        limit: int = 20,
+    ) -> list[MirroredPostVersion]:
+        if not self.enabled:
+            return []
+        column, value = ("post_id", post_id) if post_id is not None else ("updater_id", updater_id)
+        return await self.run(self.read_post_versions, column, value, before or 2**63 - 1, limit)
+
+    def read_post_versions(self, column: str, value: int | None, before: int, limit: int) -> list[MirroredPostVersion]:
+        rows = self.connection.execute(
+            "SELECT id, post_id, updater_id, updated_at, tag_count, added, removed FROM post_versions "  # noqa: S608
+            f"WHERE {column} = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (value, before, limit),
+        )
+        return [self.decode_post_version(row) for row in rows]
+
+    async def artist_versions(
+        self,
+        artist_id: int | None = None,
+        updater_id: int | None = None,
+        before: int | None = None,
+        limit: int = 20,
+    ) -> list[ArtistVersionRecord]:
+        if not self.enabled:
+            return []
+        column, value = ("artist_id", artist_id) if artist_id is not None else ("updater_id", updater_id)
+        return await self.run(self.read_artist_versions, column, value, before or 2**63 - 1, limit)
+
+    def read_artist_versions(self, column: str, value: int | None, before: int, limit: int) -> list[ArtistVersionRecord]:
+        rows = self.connection.execute(
+            "SELECT v.id, v.artist_id, a.name, a.created_at, v.updater_id, v.urls, v.updated_at "  # noqa: S608
+            "FROM artist_versions v JOIN artists a ON a.id = v.artist_id "
+            f"WHERE v.{column} = ? AND v.id < ? ORDER BY v.id DESC LIMIT ?",
+            (value, before, limit),
+        )
+        return [
+            ArtistVersionRecord(version_id, artist_id, name, created_at, updater, tuple(urls.split("\n")) if urls else (), updated_at)
+            for version_id, artist_id, name, created_at, updater, urls, updated_at in rows
+        ]
+
+    async def previous_artist_urls(self, artist_ids: Sequence[int], after: int) -> dict[int, tuple[str, ...]]:
+        # urls as of version `after`, only for artists with a version in the gapless stretch of the mirror that ends there
+        # everything else still has to be looked up, and if the stretch doesn't reach `after` nothing can be trusted
+        if not self.enabled or not artist_ids:
+            return {}
+        return await self.run(self.read_previous_artist_urls, artist_ids, after)
+
+    def read_previous_artist_urls(self, artist_ids: Sequence[int], after: int) -> dict[int, tuple[str, ...]]:
+        coverage = self.connection.execute("SELECT start_id, end_id FROM coverage WHERE stream = 'artist_versions'").fetchone()
+        if coverage is None or coverage[1] != after:
+            return {}
+        placeholders = ",".join("?" * len(artist_ids))
+        rows = self.connection.execute(
+            "SELECT artist_id, urls FROM artist_versions WHERE id IN ("  # noqa: S608
+            f"  SELECT MAX(id) FROM artist_versions WHERE artist_id IN ({placeholders}) AND id > ? AND id <= ? GROUP BY artist_id"
+            ")",
+            (*artist_ids, coverage[0], after),
+        )
+        return {artist_id: tuple(urls.split("\n")) if urls else () for artist_id, urls in rows}
+
+    async def close(self) -> None:
+        if self.enabled:
+            await self.run(self.connection.close)
+            self.executor.shutdown()
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import datetime
+import sys
+from typing import Any, NamedTuple
+
+# versions are decoded straight into flat tuples instead of full models: a 1000 row page of these is a
+# fraction of the size, and nothing nested (updater, post) is kept around since the cache has those
+
+
+def timestamp(value: str) -> float:
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+class TagIds:
+    # tag names are stored once and referred to by small ints in every version that touches them
+    # the table is wiped when it gets too big, which is only safe between pages, when no version holds ids
+
+    def __init__(self, max_size: int = 500_000) -> None:
+        self.max_size = max_size
+        self.ids: dict[str, int] = {}
+        self.names: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def intern(self, tags: list[str]) -> tuple[int, ...]:
+        ids = self.ids
+        result = []
+        for tag in tags:
+            if (tag_id := ids.get(tag)) is None:
+                tag_id = ids[tag] = len(self.names)
+                self.names.append(sys.intern(tag))
+            result.append(tag_id)
+        return tuple(result)
+
+    def lookup(self, tag_ids: tuple[int, ...]) -> list[str]:
+        return [self.names[tag_id] for tag_id in tag_ids]
+
+    def trim(self) -> None:
+        if len(self.names) > self.max_size:
+            self.ids.clear()
+            self.names.clear()
+
+
+class PostVersionRecord(NamedTuple):
+    id: int
+    post_id: int
+    updater_id: int
+    added_tags: tuple[int, ...]
+    removed_tags: tuple[int, ...]
+    tag_count: int
+    updated_at: float
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any], tags: TagIds) -> PostVersionRecord:
+        return cls(
+            id=data["id"],
+            post_id=data["post_id"],
+            updater_id=data["updater_id"],
+            added_tags=tags.intern(data["added_tags"]),
+            removed_tags=tags.intern(data["removed_tags"]),
+            tag_count=data["tags"].count(" ") + 1 if data["tags"] else 0,
+            updated_at=timestamp(data["updated_at"]),
+        )
+
+    @property
+    def url(self) -> str:
+        return f"https://danbooru.donmai.us/post_versions/{self.id}"
+
+
+class ArtistVersionRecord(NamedTuple):
+    id: int
+    artist_id: int
+    artist_name: str
+    artist_created_at: float
+    updater_id: int
+    urls: tuple[str, ...]
+    updated_at: float
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> ArtistVersionRecord:
+        return cls(
+            id=data["id"],
+            artist_id=data["artist"]["id"],
+            artist_name=data["artist"]["name"],
+            artist_created_at=timestamp(data["artist"]["created_at"]),
+            updater_id=data["updater_id"],
+            urls=tuple(data["urls"]),
+            updated_at=timestamp(data["updated_at"]),
+        )
+
+    @property
+    def artist_url(self) -> str:
+        return f"https://danbooru.donmai.us/artists/{self.artist_id}"
+
+    @property
+    def url(self) -> str:
+        return f"https://danbooru.donmai.us/artist_versions?search[artist_id]={self.artist_id}"
+
+
+class UserRecord(NamedTuple):
+    id: int
+    name: str
+    level: int
+    level_string: str
+
+    @property
+    def url(self) -> str:
+        return f"https://danbooru.donmai.us/users/{self.id}"
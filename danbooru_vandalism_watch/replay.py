@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import itertools
+import json
+import operator
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, TextIO, TypeVar
+
+from danboorutools import logger
+
+from danbooru_vandalism_watch import detector_pool
+from danbooru_vandalism_watch.client import DanbooruClient
+from danbooru_vandalism_watch.detector_pool import init_worker
+from danbooru_vandalism_watch.detectors import BOT_IDS, ArtistEditFeatures, TagEditFeatures, feature_columns, tag_edit_columns
+from danbooru_vandalism_watch.history import ArtistUrlIndex
+from danbooru_vandalism_watch.rules import DEFAULT_RULES_PATH, RuleEngine
+from danbooru_vandalism_watch.windows import UserWindows
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Sequence
+
+    from danbooru_vandalism_watch.rules import Columns
+
+STREAMS = ("post_versions", "artist_versions")
+
+# unlike the live scan, replays can't lean on the user cache, so dumps carry the updater level with them
+FIELDS = {
+    "post_versions": "id,post_id,updater_id,added_tags,removed_tags,tags,updated_at,updater[id,level],post[id,is_deleted]",
+    "artist_versions": "id,updater_id,urls,updated_at,updater[id,level],artist[id,name,created_at]",
+}
+
+Row = dict[str, Any]
+F = TypeVar("F", TagEditFeatures, ArtistEditFeatures)
+
+# artists keep the bot edits so the previous urls stay right, they're dropped before detection instead
+FILTERS: dict[str, dict[str, str]] = {
+    "post_versions": {"updater_id_not": ",".join(BOT_IDS)},
+    "artist_versions": {},
+}
+
+def detect_rows(stream: str, rows: Sequence[F], columns: Columns | None = None) -> list[Row]:
+    vandalism_types = detector_pool._engine.evaluate_batch(stream, columns or feature_columns(rows), len(rows))
+    return [
+        {"stream": stream, "type": vandalism_type, **row._asdict()}
+        for row, vandalism_type in zip(rows, vandalism_types, strict=True)
+        if vandalism_type is not None
+    ]
+
+
+def detect_post_rows(rows: list[TagEditFeatures], columns: Columns) -> list[Row]:
+    return detect_rows("post_versions", rows, columns)
+
+
+def detect_artist_rows(rows: list[tuple[Row, list[str] | None]]) -> list[Row]:
+    return detect_rows("artist_versions", [ArtistEditFeatures.from_json(row, previous_urls) for row, previous_urls in rows])
+
+
+async def rows_from_api(client: DanbooruClient, stream: str, start: int, end: int) -> AsyncIterator[list[Row]]:
+    pages = client.paginate(
+        # bound to the request itself, so none of them can end up as one of paginate's own arguments
+        functools.partial(client.request, f"{stream}.json", **FILTERS[stream]),
+        after=start - 1,
+        key=operator.itemgetter("id"),
+        id=f"{start}..{end}",
+        only=FIELDS[stream],
+    )
+    async for page in pages:
+        yield page
+
+
+async def rows_from_dump(path: Path, start: int, end: int, batch_size: int = 1000) -> AsyncIterator[list[Row]]:
+    with path.open(encoding="utf-8") as dump:
+        rows = (json.loads(line) for line in dump if line.strip())
+        for batch in itertools.batched((row for row in rows if start <= row["id"] <= end), batch_size):
+            yield sorted(batch, key=operator.itemgetter("id"))
+
+
+class Replayer:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.client = None if args.input else DanbooruClient()
+        self.artist_urls = ArtistUrlIndex(max_size=1_000_000)
+        self.user_windows = UserWindows()
+        self.rules = RuleEngine(args.rules)
+
+        self.processed = 0
+        self.detected = 0
+
+    async def run(self) -> None:
+        args = self.args
+        if args.input:
+            source = rows_from_dump(args.input, args.start, args.end)
+        else:
+            assert self.client
+            source = rows_from_api(self.client, args.stream, args.start, args.end)
+
+        loop = asyncio.get_running_loop()
+        pending: deque[asyncio.Future[list[Row]]] = deque()
+        started_at = time.perf_counter()
+
+        with contextlib.ExitStack() as stack:
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.rules,)))
+            report = stack.enter_context(args.report.open("w", encoding="utf-8"))
+            dump = stack.enter_context(args.dump.open("w", encoding="utf-8")) if args.dump else None
+
+            async for rows in source:
+                self.processed += len(rows)
+                if dump:
+                    dump.writelines(json.dumps(row) + "\n" for row in rows)
+
+                for job in await self.jobs_for(rows):
+                    pending.append(loop.run_in_executor(pool, *job))
+
+                # results are written in submission order, so the report is deterministic
+                while len(pending) > args.workers * 2:
+                    self.write_detections(report, await pending.popleft())
+
+                logger.info(f"Replayed {self.processed} {args.stream} so far, up to #{rows[-1]['id']}.")
+
+            while pending:
+                self.write_detections(report, await pending.popleft())
+
+        elapsed = time.perf_counter() - started_at
+        logger.info(
+            f"Replayed {self.processed} {args.stream} in {elapsed:.2f}s "
+            f"({self.processed / max(elapsed, 1e-9):.0f} versions/sec). "
+            f"{self.detected} detections written to {args.report}.",
+        )
+
+        if self.client:
+            self.client.close()
+
+    async def jobs_for(self, rows: list[Row]) -> list[tuple[Any, ...]]:
+        batch_size = self.args.batch_size
+        if self.args.stream == "post_versions":
+            # the rolling user windows depend on stream order too, so they're read here and the workers only run the rules
+            needed = self.rules.features("post_versions")
+            jobs = []
+            for chunk in itertools.batched(rows, batch_size):
+                features = [TagEditFeatures.from_json(row) for row in chunk]
+                jobs.append((detect_post_rows, features, tag_edit_columns(features, self.user_windows, needed)))
+            self.user_windows.evict()
+            return jobs
+
+        # previous urls depend on the order of the stream, so they're resolved here and not in the workers
+        if self.client:
+            await self.artist_urls.prefetch(
+                self.client,
+                artist_ids=(row["artist"]["id"] for row in rows if not row["urls"]),
+                after=rows[0]["id"] - 1,
+            )
+        with_previous = []
+        for row in rows:
+            if str(row["updater_id"]) not in BOT_IDS:
+                with_previous.append((row, self.artist_urls.get(row["artist"]["id"])))
+            self.artist_urls.remember(row["artist"]["id"], row["urls"])
+        return [(detect_artist_rows, list(chunk)) for chunk in itertools.batched(with_previous, batch_size)]
+
+    def write_detections(self, report: TextIO, detections: list[Row]) -> None:
+        self.detected += len(detections)
+        for detection in detections:
+            report.write(json.dumps(detection) + "\n")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the vandalism detectors over a historical range of versions.")
+    parser.add_argument("stream", choices=STREAMS)
+    parser.add_argument("--start", type=int, default=0, help="First version id to replay.")
+    parser.add_argument("--end", type=int, default=2**63 - 1, help="Last version id to replay.")
+    parser.add_argument("--input", type=Path, help="Read versions from a jsonl dump instead of the danbooru api.")
+    parser.add_argument("--dump", type=Path, help="Also write every version that was replayed to this jsonl file.")
+    parser.add_argument("--report", type=Path, default=Path("replay_report.jsonl"), help="Where to write detections.")
+    parser.add_argument("--rules", type=Path, default=DEFAULT_RULES_PATH, help="Rules file to replay with.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=250, help="Versions per worker job.")
+    args = parser.parse_args(argv)
+    if args.input and args.stream == "artist_versions":
+        logger.warning("Replaying artists from a dump: artists whose previous version isn't in the dump will count as new.")
+    return args
+
+
+def main(argv: list[str] | None = None) -> None:
+    asyncio.run(Replayer(parse_args(argv)).run())
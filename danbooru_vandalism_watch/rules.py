@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import math
+import os
+import time
+import tomllib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from danboorutools import logger
+
+from danbooru_vandalism_watch.detectors import STREAM_FEATURES
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Mapping, Sequence
+
+    Columns = Mapping[str, Sequence[Any]]
+
+DEFAULT_RULES_PATH = Path(__file__).parent / "rules.toml"
+# how long a rule may take on one page before it gets reported, and before its matches are dropped (see detector_pool.py)
+RULE_BUDGET_MS = float(os.environ.get("NNTBOT_RULE_BUDGET_MS", "50"))
+RULE_TIMEOUT_MS = float(os.environ.get("NNTBOT_RULE_TIMEOUT_MS", "2000"))
+
+
+class RuleError(ValueError):
+    pass
+
+
+# batch masks are ints with one byte per row, set to 1 if the row matched, so that combining the masks
+# of a whole page is a couple of bitwise operations on one big int instead of a python loop per row
+
+def all_rows(size: int) -> int:
+    return int.from_bytes(b"\x01" * size, "little")
+
+
+def mask_rows(mask: int, size: int) -> Iterator[int]:
+    flags = mask.to_bytes(size, "little")
+    index = flags.find(1)
+    while index != -1:
+        yield index
+        index = flags.find(1, index + 1)
+
+
+@dataclass(frozen=True)
+class Condition:
+    feature: str
+    low: float = -math.inf
+    high: float = math.inf
+
+    @classmethod
+    def parse(cls, feature: str, spec: dict[str, Any]) -> Condition:
+        if unknown := spec.keys() - {"min", "max", "eq"}:
+            raise RuleError(f"Unknown operators for {feature}: {', '.join(unknown)}")
+        if "eq" in spec:
+            return cls(feature, float(spec["eq"]), float(spec["eq"]))
+        return cls(feature, float(spec.get("min", -math.inf)), float(spec.get("max", math.inf)))
+
+    def mask(self, columns: Columns) -> int:
+        if (column := columns.get(self.feature)) is None:
+            return 0
+
+        low, high = self.low, self.high
+        if None in column:
+            flags = [v is not None and low <= v <= high for v in column]
+        elif low == -math.inf:
+            flags = [v <= high for v in column]
+        elif high == math.inf:
+            flags = [v >= low for v in column]
+        else:
+            flags = [low <= v <= high for v in column]
+        return int.from_bytes(bytes(flags), "little")
+
+
+@dataclass
+class Rule:
+    name: str
+    clauses: tuple[tuple[Condition, ...], ...]
+    budget_ms: float = RULE_BUDGET_MS
+    timeout_ms: float = RULE_TIMEOUT_MS
+
+    evaluations: int = 0
+    hits: int = 0
+    nanoseconds: int = 0
+    over_budget: int = 0
+    timeouts: int = 0
+
+    def mask(self, columns: Columns, candidates: int) -> int:
+        started_at = time.perf_counter_ns()
+        matched = self.select(columns, candidates)
+        self.record(candidates, matched, time.perf_counter_ns() - started_at)
+        return matched
+
+    def select(self, columns: Columns, candidates: int) -> int:
+        # rows that match any clause, out of `candidates`
+        matched = 0
+        for clause in self.clauses:
+            clause_mask = candidates
+            for condition in clause:
+                clause_mask &= condition.mask(columns)
+                if not clause_mask:
+                    break
+            matched |= clause_mask
+        return matched
+
+    def record(self, candidates: int, matched: int, nanoseconds: int) -> None:
+        self.nanoseconds += nanoseconds
+        self.evaluations += candidates.bit_count()
+        self.hits += matched.bit_count()
+
+    def features(self) -> set[str]:
+        return {condition.feature for clause in self.clauses for condition in clause}
+
+
+@dataclass
+class RuleSet:
+    stream: str
+    skip: Rule
+    rules: list[Rule]
+
+    def evaluate_batch(self, columns: Columns, size: int) -> list[str | None]:
+        results: list[str | None] = [None] * size
+        remaining = all_rows(size)
+        remaining &= ~self.skip.mask(columns, remaining)
+        for rule in self.rules:
+            if not remaining:
+                break
+            matched = rule.mask(columns, remaining)
+            for row in mask_rows(matched, size):
+                results[row] = rule.name
+            remaining &= ~matched
+        return results
+
+    def combine(self, skipped: int, matches: Sequence[int], size: int) -> list[str | None]:
+        # same result as evaluate_batch, from masks that were each computed over the whole page
+        results: list[str | None] = [None] * size
+        remaining = all_rows(size) & ~skipped
+        for rule, mask in zip(self.rules, matches, strict=True):
+            matched = mask & remaining
+            for row in mask_rows(matched, size):
+                results[row] = rule.name
+            remaining &= ~matched
+        return results
+
+    def rule(self, name: str) -> Rule | None:
+        return next((rule for rule in self.all_rules() if rule.name == name), None)
+
+    def all_rules(self) -> list[Rule]:
+        return [self.skip, *self.rules]
+
+    def features(self) -> set[str]:
+        return {feature for rule in self.all_rules() for feature in rule.features()}
+
+
+def parse_clauses(stream: str, clauses: list[dict[str, Any]]) -> tuple[tuple[Condition, ...], ...]:
+    parsed = []
+    for clause in clauses:
+        if unknown := clause.keys() - STREAM_FEATURES[stream]:
+            raise RuleError(f"Unknown features for {stream}: {', '.join(sorted(unknown))}")
+        parsed.append(tuple(Condition.parse(feature, spec) for feature, spec in clause.items()))
+    return tuple(parsed)
+
+
+def load_rules(path: Path) -> dict[str, RuleSet]:
+    with path.open("rb") as rules_file:
+        config = tomllib.load(rules_file)
+
+    if unknown := config.keys() - STREAM_FEATURES.keys():
+        raise RuleError(f"Unknown streams: {', '.join(unknown)}")
+
+    return {
+        stream: RuleSet(
+            stream=stream,
+            skip=Rule(name="skip", clauses=parse_clauses(stream, section.get("skip", []))),
+            rules=[
+                Rule(
+                    name=rule["name"],
+                    clauses=parse_clauses(stream, rule["when"]),
+                    budget_ms=float(rule.get("budget_ms", RULE_BUDGET_MS)),
+                    timeout_ms=float(rule.get("timeout_ms", RULE_TIMEOUT_MS)),
+                )
+                for rule in section.get("rules", [])
+            ],
+        )
+        for stream, section in config.items()
+    }
+
+
+class RuleEngine:
+    # rules live in a toml file and are parsed again whenever the file changes
+
+    def __init__(self, path: str | Path | None = None) -> None:
+        self.path = Path(path or os.environ.get("NNTBOT_RULES_PATH", str(DEFAULT_RULES_PATH)))
+        self.mtime = 0
+        self.rulesets: dict[str, RuleSet] = {}
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        mtime = self.path.stat().st_mtime_ns
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+
+        try:
+            rulesets = load_rules(self.path)
+        except (OSError, KeyError, tomllib.TOMLDecodeError, RuleError):
+            if not self.rulesets:
+                raise
+            logger.exception(f"Couldn't reload the rules in {self.path}. Keeping the old ones.")
+            return False
+
+        # keep the counters going for rules that survived the reload
+        old_rules = {(stream, rule.name): rule for stream, ruleset in self.rulesets.items() for rule in ruleset.all_rules()}
+        for stream, ruleset in rulesets.items():
+            for rule in ruleset.all_rules():
+                if old_rule := old_rules.get((stream, rule.name)):
+                    rule.evaluations, rule.hits, rule.nanoseconds = old_rule.evaluations, old_rule.hits, old_rule.nanoseconds
+                    rule.over_budget, rule.timeouts = old_rule.over_budget, old_rule.timeouts
+
+        self.rulesets = rulesets
+        logger.info(f"Loaded {sum(len(r.rules) for r in rulesets.values())} rules from {self.path}.")
+        return True
+
+    def evaluate_batch(self, stream: str, columns: Columns, size: int) -> list[str | None]:
+        if (ruleset := self.rulesets.get(stream)) is None or not size:
+            return [None] * size
+        return ruleset.evaluate_batch(columns, size)
+
+    def features(self, stream: str) -> set[str]:
+        if (ruleset := self.rulesets.get(stream)) is None:
+            return set()
+        return ruleset.features()
+
+    def format_stats(self) -> str:
+        lines = [f"{'stream':<16} {'rule':<24} {'evaluated':>10} {'hits':>8} {'avg µs':>8} {'over budget':>11} {'timeouts':>8}"]
+        for stream, ruleset in self.rulesets.items():
+            for rule in ruleset.all_rules():
+                average = rule.nanoseconds / rule.evaluations / 1000 if rule.evaluations else 0
+                lines.append(
+                    f"{stream:<16} {rule.name:<24} {rule.evaluations:>10} {rule.hits:>8} {average:>8.2f} "
+                    f"{rule.over_budget:>11} {rule.timeouts:>8}",
+                )
+        return "\n".join(lines)
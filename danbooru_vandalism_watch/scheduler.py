@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import os
+import random
+import time
+
+# status codes worth retrying soon, anything else waits for the regular interval
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+MIN_INTERVAL = float(os.environ.get("NNTBOT_POLL_MIN_INTERVAL", "5"))
+MAX_INTERVAL = float(os.environ.get("NNTBOT_POLL_MAX_INTERVAL", "120"))
+# how many new versions a poll should find on average, the interval stretches or shrinks to match the arrival rate
+TARGET_VERSIONS = int(os.environ.get("NNTBOT_POLL_TARGET_VERSIONS", "100"))
+MAX_BACKOFF = 10 * 60
+
+SMOOTHING = 0.3
+IDLE_BACKOFF = 1.5
+
+
+class PollSchedule:
+    # when to poll a stream next, from how fast its versions have been arriving lately
+
+    def __init__(
+        self,
+        stream: str,
+        min_interval: float = MIN_INTERVAL,
+        max_interval: float = MAX_INTERVAL,
+        target_versions: int = TARGET_VERSIONS,
+    ) -> None:
+        self.stream = stream
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.target_versions = target_versions
+
+        self.interval = min(max(60, self.min_interval), self.max_interval)
+        self.rate = 0.0  # versions per second, smoothed
+        self.failures = 0
+        self.next_at = 0.0
+        self.caught_up_at: float | None = None
+        self.backlog = 0
+
+    def due(self) -> bool:
+        return time.monotonic() >= self.next_at
+
+    def succeeded(self, versions: int, page_full: bool) -> float:
+        now = time.monotonic()
+        self.failures = 0
+        self.backlog += versions
+
+        if page_full:
+            # still behind, go again right away
+            self.next_at = now
+            return 0.0
+
+        # only polls that reached the head say anything about how fast versions arrive
+        if self.caught_up_at is not None:
+            observed = self.backlog / max(now - self.caught_up_at, 1)
+            self.rate = SMOOTHING * observed + (1 - SMOOTHING) * self.rate
+        self.caught_up_at = now
+        self.backlog = 0
+
+        if not versions:
+            self.interval = min(self.interval * IDLE_BACKOFF, self.max_interval)
+            delay = self.interval
+        else:
+            if self.rate > 0:
+                self.interval = min(max(self.target_versions / self.rate, self.min_interval), self.max_interval)
+            delay = self.interval
+
+        self.next_at = now + delay
+        return delay
+
+    def failed(self, status: int | None) -> float:
+        self.failures += 1
+        if status in RETRYABLE_STATUSES:
+            delay = min(self.min_interval * 2**self.failures, MAX_BACKOFF) * random.uniform(0.5, 1.5)
+        else:
+            delay = self.interval
+
+        self.next_at = time.monotonic() + delay
+        return delay
+
+    def format_stats(self) -> str:
+        return (
+            f"{self.stream}: every {self.interval:.0f}s, {self.rate:.2f} versions/s, "
+            f"next poll in {max(self.next_at - time.monotonic(), 0):.0f}s"
+        )
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+from typing import TYPE_CHECKING
+
+from danboorutools import logger
+
+from danbooru_vandalism_watch.alerts import merge_payloads
+from danbooru_vandalism_watch.bot import NNTBot
+from danbooru_vandalism_watch.cache import RecordCache
+from danbooru_vandalism_watch.client import DanbooruClient
+from danbooru_vandalism_watch.detector_pool import DetectorPool
+from danbooru_vandalism_watch.mirror import VersionMirror
+from danbooru_vandalism_watch.rules import RuleEngine
+from danbooru_vandalism_watch.state import StateStore
+from danbooru_vandalism_watch.streams import PAGE_LIMIT, ArtistVersionStream, PostVersionStream, VersionStream
+from danbooru_vandalism_watch.triage import SuppressionFilter
+
+if TYPE_CHECKING:
+    from danbooru_vandalism_watch.alerts import Alert
+    from danbooru_vandalism_watch.state import Lease
+
+LEASE_SECONDS = int(os.environ.get("NNTBOT_LEASE_SECONDS", "120"))
+IDLE_SLEEP = 5
+
+
+class WorkerBot:
+    # the parts of NNTBot the streams use, for processes that never connect to discord
+    test_mode = NNTBot.test_mode
+
+    def __init__(self) -> None:
+        self.logger = logger
+
+
+class AlertBuffer:
+    # collects a slice's alerts, they're only handed over to the bot once the whole slice is done
+    def __init__(self) -> None:
+        self.alerts: list[Alert] = []
+
+    def submit(self, alert: Alert) -> None:
+        self.alerts.append(alert)
+
+
+class ShardWorker:
+    # scans whatever slice of a sharded stream it can lease, and leaves the alerts for the bot to send
+    # the rolling per-user windows only see the slice being checked,
+    # so window rules are less sensitive in sharded mode than in the bot's own scan
+
+    def __init__(self, worker_id: str, danbooru: DanbooruClient | None = None, state: StateStore | None = None) -> None:
+        self.worker_id = worker_id
+        self.bot = WorkerBot()
+        self.danbooru = danbooru or DanbooruClient()
+        self.state = state or StateStore()
+        self.rules = RuleEngine()
+        # there's already a worker process per core, no need for another pool under each one
+        self.detectors = DetectorPool(self.rules, processes=0)
+        self.records = RecordCache(self.danbooru)
+        self.dispatcher = AlertBuffer()
+        self.suppressions = SuppressionFilter()
+        self.mirror = VersionMirror()
+
+        streams: list[VersionStream] = [PostVersionStream(self), ArtistVersionStream(self)]  # type: ignore[arg-type]
+        self.streams = {stream.name: stream for stream in streams}
+        for stream in streams:
+            # slices finish out of order, so older versions might not have made it into the mirror yet
+            stream.trust_mirror = False
+
+    async def run(self) -> None:
+        logger.info(f"Shard worker {self.worker_id} started.")
+        while True:
+            if (lease := self.state.claim_lease(self.worker_id, LEASE_SECONDS)) is None:
+                await asyncio.sleep(IDLE_SLEEP)
+                continue
+
+            self.rules.reload_if_changed()
+            self.suppressions.reload(self.state)
+            try:
+                await self.work(lease)
+            except Exception:
+                # the lease runs out and another worker picks the slice up
+                logger.exception(f"Shard worker {self.worker_id} failed on {lease.stream} #{lease.start_id}-#{lease.end_id}.")
+                await asyncio.sleep(IDLE_SLEEP)
+
+    async def work(self, lease: Lease) -> None:
+        stream = self.streams[lease.stream]
+        self.dispatcher.alerts.clear()
+        # the last slice this worker got isn't the one right before this one, other workers did what's in between
+        stream.forget()
+
+        pages = self.danbooru.paginate(stream.fetch, after=lease.start_id, until=lease.end_id, limit=PAGE_LIMIT, **stream.filters)
+        after = lease.start_id
+        async for versions in pages:
+            await stream.scan(versions, after)
+            after = versions[-1].id
+            if not self.state.renew_lease(lease.id, self.worker_id, LEASE_SECONDS):
+                logger.warning(f"Lost the lease on {lease.stream} #{lease.start_id}-#{lease.end_id}. Dropping the slice.")
+                return
+
+        alerts = [(alert.index_key, alert.to_json()) for alert in self.dispatcher.alerts]
+        if self.state.complete_lease(lease.id, self.worker_id, alerts, merge_payloads):
+            logger.info(f"Checked {lease.stream} #{lease.start_id}-#{lease.end_id}, {len(alerts)} alerts.")
+        else:
+            logger.warning(f"Finished {lease.stream} #{lease.start_id}-#{lease.end_id} after the lease ran out. Dropping the slice.")
+
+
+def run_worker(worker_id: str) -> None:
+    asyncio.run(ShardWorker(worker_id).run())
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Scan the id ranges leased out by the bot for the streams in NNTBOT_SHARDED_STREAMS.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Worker processes to start.")
+    parser.add_argument("--name", default=socket.gethostname(), help="Prefix for the worker ids that own leases.")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(f"{args.name}-{os.getpid()}-{index}",), name=f"shard-{index}")
+        for index in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
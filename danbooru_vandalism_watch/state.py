@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from danbooru_vandalism_watch.triage import Verdict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cursors (
+    stream TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS pending_alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    alert_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS pending_alerts_key ON pending_alerts (alert_key);
+
+CREATE TABLE IF NOT EXISTS open_alerts (
+    alert_key TEXT PRIMARY KEY,
+    message_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS open_alerts_message_id ON open_alerts (message_id);
+
+CREATE TABLE IF NOT EXISTS leases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stream TEXT NOT NULL,
+    start_id INTEGER NOT NULL,  -- exclusive
+    end_id INTEGER NOT NULL,  -- inclusive
+    owner TEXT,
+    expires_at REAL,
+    done INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS leases_stream_start ON leases (stream, start_id);
+
+CREATE TABLE IF NOT EXISTS sent_alerts (
+    message_id INTEGER PRIMARY KEY,
+    rule TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    sent_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS sent_alerts_rule ON sent_alerts (rule);
+
+CREATE TABLE IF NOT EXISTS triage (
+    message_id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    rule TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    verdict TEXT NOT NULL,  -- handled or false_positive
+    moderator_id INTEGER NOT NULL,
+    shape TEXT NOT NULL,
+    features TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS triage_rule_user ON triage (rule, user_id);
+CREATE INDEX IF NOT EXISTS triage_rule_shape ON triage (rule, shape);
+"""
+
+
+class Lease(NamedTuple):
+    id: int
+    stream: str
+    start_id: int
+    end_id: int
+
+
+class StateStore:
+    # small sqlite file that survives restarts, so the bot can pick up where it left off
+
+    def __init__(self, path: str | Path | None = None) -> None:
+        self.path = Path(path or os.environ.get("NNTBOT_STATE_PATH", "data/state.sqlite3"))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.path, timeout=30)  # shard workers write to the same file
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def get_cursor(self, stream: str) -> int | None:
+        row = self.connection.execute("SELECT last_id FROM cursors WHERE stream = ?", (stream,)).fetchone()
+        return row[0] if row else None
+
+    def set_cursor(self, stream: str, last_id: int) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO cursors (stream, last_id) VALUES (?, ?) "
+                "ON CONFLICT (stream) DO UPDATE SET last_id = excluded.last_id, updated_at = CURRENT_TIMESTAMP",
+                (stream, last_id),
+            )
+
+    def add_alert(self, alert_key: str, payload: str, merge: Callable[[str, str], str]) -> int:
+        with self.connection:
+            return self.queue_alert(alert_key, payload, merge)
+
+    def queue_alert(self, alert_key: str, payload: str, merge: Callable[[str, str], str]) -> int:
+        # one pending row per user and vandalism type, later detections are merged into it
+        # so a flood of them can't grow the queue past the number of users being flagged
+        row = self.connection.execute("SELECT id, payload FROM pending_alerts WHERE alert_key = ? LIMIT 1", (alert_key,)).fetchone()
+        if row is not None:
+            self.connection.execute("UPDATE pending_alerts SET payload = ? WHERE id = ?", (merge(row[1], payload), row[0]))
+            return row[0]
+        cursor = self.connection.execute("INSERT INTO pending_alerts (alert_key, payload) VALUES (?, ?)", (alert_key, payload))
+        assert cursor.lastrowid is not None
+        return cursor.lastrowid
+
+    def pending_alerts(self, limit: int) -> list[tuple[int, str]]:
+        return self.connection.execute("SELECT id, payload FROM pending_alerts ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+    def remove_alerts(self, alerts: list[tuple[int, str]]) -> None:
+        # a row that was merged into while it was being sent keeps the new payload and goes out again
+        with self.connection:
+            self.connection.executemany("DELETE FROM pending_alerts WHERE id = ? AND payload = ?", alerts)
+
+    def count_alerts(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM pending_alerts").fetchone()[0]
+
+    def get_open_alert(self, alert_key: str, since: float) -> tuple[int, str] | None:
+        return self.connection.execute(
+            "SELECT message_id, payload FROM open_alerts WHERE alert_key = ? AND updated_at >= ?",
+            (alert_key, since),
+        ).fetchone()
+
+    def set_open_alert(self, alert_key: str, message_id: int, payload: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO open_alerts (alert_key, message_id, payload, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (alert_key) DO UPDATE SET "
+                "message_id = excluded.message_id, payload = excluded.payload, updated_at = excluded.updated_at",
+                (alert_key, message_id, payload, time.time()),
+            )
+
+    def close_alert(self, message_id: int) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM open_alerts WHERE message_id = ?", (message_id,))
+
+    def expire_open_alerts(self, before: float) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM open_alerts WHERE updated_at < ?", (before,))
+
+    def plan_leases(self, stream: str, after: int, head: int, size: int) -> int:
+        # hands out (after, head] to shard workers in slices of `size`, picking up where the last plan stopped
+        with self.connection:
+            planned_until = self.connection.execute("SELECT MAX(end_id) FROM leases WHERE stream = ?", (stream,)).fetchone()[0]
+            start = max(planned_until or after, after)
+            slices = [(stream, slice_start, min(slice_start + size, head)) for slice_start in range(start, head, size)]
+            self.connection.executemany("INSERT INTO leases (stream, start_id, end_id) VALUES (?, ?, ?)", slices)
+        return len(slices)
+
+    def claim_lease(self, owner: str, seconds: float) -> Lease | None:
+        now = time.time()
+        with self.connection:
+            row = self.connection.execute(
+                "UPDATE leases SET owner = ?, expires_at = ? WHERE id = ("
+                "  SELECT id FROM leases WHERE done = 0 AND (owner IS NULL OR expires_at < ?) ORDER BY start_id LIMIT 1"
+                ") RETURNING id, stream, start_id, end_id",
+                (owner, now + seconds, now),
+            ).fetchone()
+        return Lease(*row) if row else None
+
+    def renew_lease(self, lease_id: int, owner: str, seconds: float) -> bool:
+        with self.connection:
+            cursor = self.connection.execute(
+                "UPDATE leases SET expires_at = ? WHERE id = ? AND owner = ? AND done = 0",
+                (time.time() + seconds, lease_id, owner),
+            )
+        return cursor.rowcount == 1
+
+    def complete_lease(self, lease_id: int, owner: str, alerts: list[tuple[str, str]], merge: Callable[[str, str], str]) -> bool:
+        # a worker whose lease was taken over by another one throws its results away, so nothing gets reported twice
+        with self.connection:
+            cursor = self.connection.execute("UPDATE leases SET done = 1 WHERE id = ? AND owner = ? AND done = 0", (lease_id, owner))
+            if cursor.rowcount != 1:
+                return False
+            for alert_key, payload in alerts:
+                self.queue_alert(alert_key, payload, merge)
+        return True
+
+    def advance_past_leases(self, stream: str, cursor: int) -> int:
+        # the cursor only moves over leases that are done and contiguous, a slow slice holds back everything after it
+        # leases that end up behind the cursor anyway (after a capped catch-up on boot) are dropped, done or not
+        with self.connection:
+            leases = self.connection.execute(
+                "SELECT id, start_id, end_id, done FROM leases WHERE stream = ? AND end_id > ? ORDER BY start_id",
+                (stream, cursor),
+            ).fetchall()
+            finished = []
+            for lease_id, start_id, end_id, done in leases:
+                if not done or start_id > cursor:
+                    break
+                cursor = end_id
+                finished.append((lease_id,))
+            self.connection.executemany("DELETE FROM leases WHERE id = ?", finished)
+            self.connection.execute("DELETE FROM leases WHERE stream = ? AND end_id <= ?", (stream, cursor))
+        return cursor
+
+    def record_sent_alert(self, message_id: int, rule: str, payload: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO sent_alerts (message_id, rule, payload) VALUES (?, ?, ?) "
+                "ON CONFLICT (message_id) DO UPDATE SET payload = excluded.payload",
+                (message_id, rule, payload),
+            )
+
+    def sent_alert(self, message_id: int) -> str | None:
+        row = self.connection.execute("SELECT payload FROM sent_alerts WHERE message_id = ?", (message_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_verdict(self, verdict: Verdict) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO triage (message_id, kind, rule, user_id, verdict, moderator_id, shape, features) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                verdict,
+            )
+
+    def clear_verdict(self, message_id: int) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM triage WHERE message_id = ?", (message_id,))
+
+    def rule_precision(self) -> list[tuple[str, int, int, int]]:
+        return self.connection.execute(
+            "SELECT sent_alerts.rule, COUNT(*), "
+            "COALESCE(SUM(verdict = 'handled'), 0), COALESCE(SUM(verdict = 'false_positive'), 0) "
+            "FROM sent_alerts LEFT JOIN triage USING (message_id) GROUP BY sent_alerts.rule ORDER BY sent_alerts.rule",
+        ).fetchall()
+
+    def false_positive_users(self, threshold: int) -> list[tuple[str, int]]:
+        return self.connection.execute(
+            "SELECT rule, user_id FROM triage GROUP BY rule, user_id "
+            "HAVING SUM(verdict = 'false_positive') >= ? AND SUM(verdict = 'handled') = 0",
+            (threshold,),
+        ).fetchall()
+
+    def false_positive_shapes(self, threshold: int) -> list[tuple[str, str]]:
+        return self.connection.execute(
+            "SELECT rule, shape FROM triage GROUP BY rule, shape "
+            "HAVING SUM(verdict = 'false_positive') >= ? AND SUM(verdict = 'handled') = 0",
+            (threshold,),
+        ).fetchall()
+
+    def close(self) -> None:
+        self.connection.close()
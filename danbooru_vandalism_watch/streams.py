@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import TYPE_CHECKING, Any, ClassVar, TypeVar
+
+from danboorutools.exceptions import DanbooruHTTPError, HTTPError
+from discord.ext import tasks
+
+from danbooru_vandalism_watch.alerts import Alert
+from danbooru_vandalism_watch.detectors import BOT_IDS, ArtistEditFeatures, TagEditFeatures, feature_columns, tag_edit_columns
+from danbooru_vandalism_watch.history import ArtistUrlIndex
+from danbooru_vandalism_watch.metrics import (
+    CURSOR_LAG_SECONDS,
+    CURSOR_LAG_VERSIONS,
+    DETECTIONS,
+    SCAN_SECONDS,
+    SUPPRESSED,
+    VERSIONS,
+    VERSIONS_PER_SECOND,
+)
+from danbooru_vandalism_watch.scheduler import MAX_INTERVAL, PollSchedule
+from danbooru_vandalism_watch.windows import UserWindows
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from danbooru_vandalism_watch.models import ArtistVersionRecord, PostVersionRecord
+    from danbooru_vandalism_watch.rules import Columns
+    from danbooru_vandalism_watch.vandalism_checker import VandalismChecker
+
+
+V = TypeVar("V", bound="PostVersionRecord | ArtistVersionRecord")
+
+# on boot, don't try to catch up on more than this many versions per stream
+MAX_CATCHUP_VERSIONS = int(os.environ.get("NNTBOT_MAX_CATCHUP_VERSIONS", "50000"))
+# a stream with a backlog stops after this many pages to report progress, then gets polled again right away
+MAX_PAGES_PER_POLL = int(os.environ.get("NNTBOT_MAX_PAGES_PER_POLL", "10"))
+PAGE_LIMIT = 1000
+# streams listed here are scanned by shard workers (see sharding.py), the bot only leases out id ranges to them
+SHARDED_STREAMS = {stream for stream in os.environ.get("NNTBOT_SHARDED_STREAMS", "").split(",") if stream}
+SHARD_SIZE = int(os.environ.get("NNTBOT_SHARD_SIZE", "5000"))
+
+
+class VersionStream(ABC):
+    # one danbooru *_versions endpoint: its cursor, how to fetch it and what counts as vandalism in it
+    # every stream polls on its own loop and they all share the client's thread pool,
+    # so adding a stream doesn't make the others any slower
+    name: ClassVar[str]
+    filters: ClassVar[dict[str, Any]] = {"updater_id_not": ",".join(BOT_IDS)}
+
+    def __init__(self, checker: VandalismChecker) -> None:
+        self.bot = checker.bot
+        self.danbooru = checker.danbooru
+        self.state = checker.state
+        self.rules = checker.rules
+        self.detectors = checker.detectors
+        self.records = checker.records
+        self.dispatcher = checker.dispatcher
+        self.suppressions = checker.suppressions
+        self.mirror = checker.mirror
+        # the mirror knows which stretch it has without gaps, but shard workers share it and finish slices out of order
+        self.trust_mirror = True
+
+        self.cursor: int
+        self.schedule = PollSchedule(self.name, max_interval=10 if self.bot.test_mode else MAX_INTERVAL)
+        self.sharded = self.name in SHARDED_STREAMS
+        self.loop = tasks.loop(seconds=1)(self.poll)
+        self.loop.before_loop(self.wait_for_boot)
+
+    @abstractmethod
+    async def fetch(self, **kwargs) -> list[Any]: ...
+
+    @abstractmethod
+    async def scan(self, versions: list[Any], after: int) -> None: ...
+
+    def forget(self) -> None:
+        # drops whatever the stream remembers from earlier versions, for when the next page doesn't follow the last one
+        return
+
+    def detections(self, versions: list[V], vandalism_types: list[str | None], columns: Columns) -> Iterator[tuple[V, str, dict[str, Any]]]:
+        # the features each rule looks at go along with the alert, so moderator verdicts can be tied back to them
+        needed = [name for name in self.rules.features(self.name) if name in columns]
+        for index, (version, vandalism_type) in enumerate(zip(versions, vandalism_types, strict=True)):
+            if vandalism_type is None or str(version.updater_id) in BOT_IDS:
+                continue
+            DETECTIONS.inc(stream=self.name, rule=vandalism_type)
+            features = {name: columns[name][index] for name in needed}
+            if self.suppressions.is_suppressed(vandalism_type, version.updater_id, features):
+                SUPPRESSED.inc(stream=self.name, rule=vandalism_type)
+                self.bot.logger.debug(f"{self.name} #{version.id} matches known false positives for '{vandalism_type}'. Skipping.")
+                continue
+            yield version, vandalism_type, features
+
+    async def wait_for_boot(self) -> None:
+        # scanning doesn't need discord, alerts just queue up until the dispatcher is connected
+        # an exception in here would stop the loop for good, so danbooru being down on boot only delays the first scan
+        for attempt in itertools.count():
+            try:
+                head = (await self.fetch(limit=1))[0].id
+            except Exception:
+                delay = min(2**attempt, MAX_INTERVAL)
+                self.bot.logger.exception(f"Couldn't get the latest {self.name} on boot. Trying again in {delay:.0f}s...")
+                await asyncio.sleep(delay)
+            else:
+                self.cursor = self.resume_cursor(head)
+                return
+
+    def resume_cursor(self, head: int) -> int:
+        if (stored := self.state.get_cursor(self.name)) is None:
+            self.bot.logger.info(f"No saved cursor for {self.name}. Starting from the latest version, #{head}.")
+            self.state.set_cursor(self.name, head)
+            return head
+
+        if head - stored > MAX_CATCHUP_VERSIONS:
+            self.bot.logger.warning(
+                f"Saved cursor for {self.name} is {head - stored} versions behind. "
+                f"Only catching up on the last {MAX_CATCHUP_VERSIONS}.",
+            )
+            return head - MAX_CATCHUP_VERSIONS
+
+        self.bot.logger.info(f"Resuming {self.name} from #{stored}, {max(head - stored, 0)} versions behind.")
+        return stored
+
+    async def poll(self) -> None:
+        # ticks every second, but only does anything once the schedule says so
+        if not self.schedule.due():
+            return
+
+        started_at = time.perf_counter()
+        try:
+            self.rules.reload_if_changed()
+            self.bot.logger.debug(f"Scanning {self.name}...")
+            versions, page_full = await (self.coordinate() if self.sharded else self.check())
+        except (HTTPError, DanbooruHTTPError) as e:
+            delay = self.schedule.failed(e.status_code)
+            self.bot.logger.exception(f"Encountered an exception with danbooru while scanning {self.name}. Trying again in {delay:.0f}s...")
+        except Exception:
+            self.schedule.failed(None)
+            self.bot.logger.exception("Encountered an exception. Sending to owner...")
+            await self.bot.alert_owner()
+        else:
+            elapsed = time.perf_counter() - started_at
+            SCAN_SECONDS.observe(elapsed, stream=self.name)
+            VERSIONS_PER_SECOND.set(versions / elapsed, stream=self.name)
+
+            delay = self.schedule.succeeded(versions, page_full)
+            self.bot.logger.debug(self.records.format_stats())
+            self.bot.logger.info(f"Done! {versions} new {self.name} in {elapsed:.1f}s, next scan in {delay:.0f}s.")
+
+    async def check(self) -> tuple[int, bool]:
+        pages = self.danbooru.paginate(self.fetch, after=self.cursor, limit=PAGE_LIMIT, max_pages=MAX_PAGES_PER_POLL, **self.filters)
+
+        found, page_full, last_updated_at = 0, False, time.time()
+        async for versions in pages:
+            found += len(versions)
+            page_full = len(versions) == PAGE_LIMIT
+            self.bot.logger.debug(f"Checking {len(versions)} {self.name}, #{versions[0].id} to #{versions[-1].id}.")
+            try:
+                await self.scan(versions, after=self.cursor)
+            except Exception:
+                # the page is checked again from the same cursor next poll, so whatever it already taught the stream
+                # has to go, or the retry would compare each version against itself
+                self.forget()
+                raise
+            VERSIONS.inc(len(versions), stream=self.name)
+            # only move past a page once all of its detections have been queued
+            self.cursor = versions[-1].id
+            last_updated_at = versions[-1].updated_at
+            self.state.set_cursor(self.name, self.cursor)
+
+        if not found:
+            self.bot.logger.debug(f"No new {self.name} found.")
+
+        if page_full:
+            # only worth a request when there's a backlog, otherwise the poll ended at the head
+            head = (await self.fetch(limit=1))[0].id
+            CURSOR_LAG_VERSIONS.set(head - self.cursor, stream=self.name)
+            CURSOR_LAG_SECONDS.set(max(time.time() - last_updated_at, 0), stream=self.name)
+        else:
+            CURSOR_LAG_VERSIONS.set(0, stream=self.name)
+            CURSOR_LAG_SECONDS.set(0, stream=self.name)
+        return found, page_full
+
+    async def coordinate(self) -> tuple[int, bool]:
+        head = (await self.fetch(limit=1))[0].id
+        if planned := self.state.plan_leases(self.name, after=self.cursor, head=head, size=SHARD_SIZE):
+            self.bot.logger.debug(f"Leased out {planned} new slices of {self.name}, up to #{head}.")
+
+        cursor = self.state.advance_past_leases(self.name, self.cursor)
+        found, self.cursor = cursor - self.cursor, cursor  # ids, not versions, close enough
+        self.state.set_cursor(self.name, self.cursor)
+
+        VERSIONS.inc(found, stream=self.name)
+        CURSOR_LAG_VERSIONS.set(head - self.cursor, stream=self.name)
+        return found, False
+
+
+class PostVersionStream(VersionStream):
+    name = "post_versions"
+    filters = {**VersionStream.filters, "is_new": False}
+
+    def __init__(self, checker: VandalismChecker) -> None:
+        super().__init__(checker)
+        self.user_windows = UserWindows()
+
+    def forget(self) -> None:
+        self.user_windows = UserWindows()
+
+    async def fetch(self, **kwargs) -> list[PostVersionRecord]:
+        return await self.danbooru.post_versions(**kwargs)
+
+    async def scan(self, versions: list[PostVersionRecord], after: int) -> None:
+        await self.mirror.append_post_versions(versions, after, self.danbooru.tags)
+        await self.records.prefetch(
+            user_ids=(post_version.updater_id for post_version in versions),
+            post_ids=(post_version.post_id for post_version in versions),
+        )
+
+        detected_by_user: dict[str, dict[int, list[PostVersionRecord]]] = defaultdict(lambda: defaultdict(list))
+        features_by_user: dict[tuple[str, int], dict[str, dict[str, Any]]] = defaultdict(dict)
+        for post_version, tag_vandalism_type, features in self.detections(versions, *await self.vandalism_types(versions)):
+            self.bot.logger.debug(
+                f"<r>Post version {post_version.url} was detected as vandalism of type '{tag_vandalism_type}'. Sending...</r>",
+            )
+            detected_by_user[tag_vandalism_type][post_version.updater_id].append(post_version)
+            features_by_user[tag_vandalism_type, post_version.updater_id][str(post_version.id)] = features
+
+        self.user_windows.evict()
+        self.danbooru.tags.trim()
+
+        for vandalism_type, edits_by_user in detected_by_user.items():
+            for updater_id, edits in edits_by_user.items():
+                self.report(vandalism_type=vandalism_type, post_versions=list(edits), features=features_by_user[vandalism_type, updater_id])
+
+    async def vandalism_types(self, post_versions: list[PostVersionRecord]) -> tuple[list[str | None], Columns]:
+        if self.bot.test_mode:
+            return ["Mass Tag Removal"] * len(post_versions), {}
+
+        rows = [TagEditFeatures.from_post_version(post_version, self.records) for post_version in post_versions]
+        columns = tag_edit_columns(rows, self.user_windows, needed=self.rules.features(self.name))
+        return await self.detectors.evaluate(self.name, columns, len(rows)), columns
+
+    def report(self, vandalism_type: str, post_versions: list[PostVersionRecord], features: dict[str, dict[str, Any]]) -> None:
+        user = self.records.user(post_versions[0].updater_id)
+        self.bot.logger.info(f"<r>Sending vandalism for user #{user.url}</r>")
+
+        self.dispatcher.submit(Alert(
+            kind="tag",
+            vandalism_type=vandalism_type,
+            user_id=user.id,
+            user_name=user.name,
+            user_level_string=user.level_string,
+            timestamp=int(max(post_versions, key=lambda x: x.updated_at).updated_at),
+            version_ids=[p.id for p in post_versions],
+            features=features,
+        ))
+
+
+class ArtistVersionStream(VersionStream):
+    name = "artist_versions"
+    # bot edits are fetched too, or the next edit after one would be compared against urls from before it
+    # they're only left out of the detections
+    filters = {}
+
+    def __init__(self, checker: VandalismChecker) -> None:
+        super().__init__(checker)
+        self.artist_urls = ArtistUrlIndex()
+
+    def forget(self) -> None:
+        self.artist_urls = ArtistUrlIndex()
+
+    async def fetch(self, **kwargs) -> list[ArtistVersionRecord]:
+        return await self.danbooru.artist_versions(**kwargs)
+
+    async def scan(self, versions: list[ArtistVersionRecord], after: int) -> None:
+        # only url wipes can be vandalism, so those are the only ones that need the previous version
+        await self.artist_urls.prefetch(
+            self.danbooru,
+            artist_ids=(a.artist_id for a in versions if not a.urls),
+            after=after,
+            mirror=self.mirror if self.trust_mirror else None,
+        )
+        await self.records.prefetch(user_ids=(a.updater_id for a in versions))
+
+        for artist_version, artist_vandalism_type, features in self.detections(versions, *await self.vandalism_types(versions)):
+            self.bot.logger.info(
+                f"<r>Artist version for artist {artist_version.artist_url} was detected as vandalism. Sending...</r>",
+            )
+            self.report(artist_version, vandalism_type=artist_vandalism_type, features=features)
+
+        await self.mirror.append_artist_versions(versions, after)
+
+    async def vandalism_types(self, artist_versions: list[ArtistVersionRecord]) -> tuple[list[str | None], Columns]:
+        rows = []
+        for artist_version in artist_versions:
+            # walked in id order, so each version is compared against the one right before it
+            previous_urls = self.artist_urls.get(artist_version.artist_id)
+            rows.append(ArtistEditFeatures.from_artist_version(artist_version, previous_urls, self.records))
+            self.artist_urls.remember(artist_version.artist_id, artist_version.urls)
+        columns = feature_columns(rows)
+        return await self.detectors.evaluate(self.name, columns, len(rows)), columns
+
+    def report(self, artist_version: ArtistVersionRecord, vandalism_type: str, features: dict[str, Any]) -> None:
+        user = self.records.user(artist_version.updater_id)
+        self.bot.logger.info(f"<r>Sending vandalism for artist {artist_version.urls}</r>")
+
+        self.dispatcher.submit(Alert(
+            kind="artist",
+            vandalism_type=vandalism_type,
+            user_id=user.id,
+            user_name=user.name,
+            user_level_string=user.level_string,
+            timestamp=int(artist_version.updated_at),
+            version_ids=[artist_version.id],
+            artist_id=artist_version.artist_id,
+            artist_name=artist_version.artist_name,
+            features={str(artist_version.id): features},
+        ))
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+from collections import Counter
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+if TYPE_CHECKING:
+    from danbooru_vandalism_watch.alerts import Alert
+    from danbooru_vandalism_watch.state import StateStore
+
+HANDLED = "handled"
+FALSE_POSITIVE = "false_positive"
+
+# this many false positives and not a single confirmed alert, and the user stops being reported for that rule
+SUPPRESS_AFTER = int(os.environ.get("NNTBOT_SUPPRESS_AFTER", "3"))
+# shapes mute a rule for everyone, so they need a lot more evidence than a single user
+SHAPE_SUPPRESS_AFTER = int(os.environ.get("NNTBOT_SHAPE_SUPPRESS_AFTER", "10"))
+# who made the edit isn't part of what it looks like, or a few gardener false positives would hide vandals' edits too
+SHAPE_IGNORED_FEATURES = {"id", "updater_id", "artist_id", "updater_level"}
+
+
+def feature_shape(features: dict[str, Any]) -> str:
+    # features rounded to powers of two, so "removed 40 tags from a 45 tag post" and "removed 35 from 38" look the same
+    def bucket(value: float | None) -> int | None:
+        if value is None:
+            return None
+        return int(math.copysign(math.floor(math.log2(abs(value) + 1)), value))
+
+    shape = {name: bucket(value) for name, value in sorted(features.items()) if name not in SHAPE_IGNORED_FEATURES}
+    return json.dumps(shape, separators=(",", ":"))
+
+
+class Verdict(NamedTuple):
+    message_id: int
+    kind: str
+    rule: str
+    user_id: int
+    verdict: str
+    moderator_id: int
+    shape: str
+    features: str
+
+    @classmethod
+    def from_alert(cls, message_id: int, alert: Alert, verdict: str, moderator_id: int) -> Verdict:
+        # a merged alert is filed under the shape most of its versions share
+        shapes = Counter(feature_shape(features) for features in alert.features.values())
+        return cls(
+            message_id=message_id,
+            kind=alert.kind,
+            rule=alert.vandalism_type,
+            user_id=alert.user_id,
+            verdict=verdict,
+            moderator_id=moderator_id,
+            shape=min(shapes, key=lambda shape: (-shapes[shape], shape)) if shapes else feature_shape({}),
+            features=json.dumps(alert.features),
+        )
+
+
+class SuppressionFilter:
+    # known false positives compiled down to two sets, checked for every detection before it's reported
+
+    def __init__(self) -> None:
+        self.users: set[tuple[str, int]] = set()
+        self.shapes: set[tuple[str, str]] = set()
+        self.suppressed = 0
+
+    def reload(self, state: StateStore) -> None:
+        self.users = set(state.false_positive_users(SUPPRESS_AFTER))
+        self.shapes = set(state.false_positive_shapes(SHAPE_SUPPRESS_AFTER))
+
+    def is_suppressed(self, rule: str, user_id: int, features: dict[str, Any]) -> bool:
+        if (rule, user_id) in self.users or (self.shapes and (rule, feature_shape(features)) in self.shapes):
+            self.suppressed += 1
+            return True
+        return False
+
+
+def format_precision(rows: list[tuple[str, int, int, int]]) -> str:
+    # recall would need the vandalism that was never alerted on, which nobody marks, so only precision is known
+    lines = [f"{'rule':<24} {'alerts':>7} {'handled':>8} {'false +':>8} {'untriaged':>10} {'precision':>10}"]
+    for rule, alerts, handled, false_positives in rows:
+        triaged = handled + false_positives
+        precision = f"{handled / triaged:.0%}" if triaged else "-"
+        lines.append(f"{rule:<24} {alerts:>7} {handled:>8} {false_positives:>8} {alerts - triaged:>10} {precision:>10}")
+    return "\n".join(lines)
@@ -3,6 +3,8 @@ from danboorutools import logger
 from discord import Color
 from discord.types.embed import Embed
 
+from danbooru_vandalism_watch.triage import FALSE_POSITIVE, HANDLED
+
 
 class Styles:
     active = discord.ButtonStyle.green
@@ -46,6 +48,8 @@ class PersistentView(discord.ui.View):
 
         self.fix_buttons(button, original_label, undo_label)
         await interaction.response.edit_message(embed=embed, view=self)
+        verdict = None if is_revert else HANDLED
+        interaction.client.dispatch("alert_triaged", interaction.message.id, verdict, interaction.user.id)  # type: ignore[union-attr]
 
     @discord.ui.button(label=Labels.false_positive, style=Styles.active, custom_id="persistent_view:grey")
     async def grey(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
@@ -73,6 +77,8 @@ class PersistentView(discord.ui.View):
 
         self.fix_buttons(button, original_label, undo_label)
         await interaction.response.edit_message(embed=embed, view=self)
+        verdict = None if is_revert else FALSE_POSITIVE
+        interaction.client.dispatch("alert_triaged", interaction.message.id, verdict, interaction.user.id)  # type: ignore[union-attr]
 
     def fix_title(self, embed: discord.Embed, suffix: str, is_revert: bool) -> None:
         assert embed.title
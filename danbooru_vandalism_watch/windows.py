@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from array import array
+from collections import OrderedDict
+from typing import NamedTuple
+
+# name -> (span, bucket size), both in seconds
+DEFAULT_WINDOWS = {
+    "5m": (5 * 60, 60),
+    "1h": (60 * 60, 5 * 60),
+    "24h": (24 * 60 * 60, 60 * 60),
+}
+
+
+class WindowTotals(NamedTuple):
+    edits: int = 0
+    edits_with_removals: int = 0
+    removed_tags: int = 0
+    added_tags: int = 0
+
+
+FIELDS = len(WindowTotals._fields)
+
+
+class RingWindow:
+    # fixed ring of time buckets with running totals, so reading the window is O(1)
+    # and stepping forward only ever clears the buckets that fell out of it
+    __slots__ = ("bucket_seconds", "counts", "head", "size", "totals")
+
+    def __init__(self, span: int, bucket_seconds: int) -> None:
+        self.bucket_seconds = bucket_seconds
+        self.size = max(span // bucket_seconds, 1)
+        self.counts = array("q", bytes(8 * self.size * FIELDS))
+        self.totals = array("q", bytes(8 * FIELDS))
+        self.head = -1  # most recent bucket we've advanced to
+
+    def advance(self, timestamp: float) -> None:
+        bucket = int(timestamp // self.bucket_seconds)
+        if bucket <= self.head:
+            return
+        for stale in range(max(self.head + 1, bucket - self.size + 1), bucket + 1):
+            offset = (stale % self.size) * FIELDS
+            for field in range(FIELDS):
+                self.totals[field] -= self.counts[offset + field]
+                self.counts[offset + field] = 0
+        self.head = bucket
+
+    def add(self, timestamp: float, values: tuple[int, ...]) -> None:
+        self.advance(timestamp)
+        bucket = int(timestamp // self.bucket_seconds)
+        if bucket <= self.head - self.size:
+            return  # older than the whole window
+        offset = (bucket % self.size) * FIELDS
+        for field, value in enumerate(values):
+            self.counts[offset + field] += value
+            self.totals[field] += value
+
+    def read(self) -> WindowTotals:
+        return WindowTotals(*self.totals)
+
+
+class UserActivity:
+    __slots__ = ("last_seen", "windows")
+
+    def __init__(self, windows: dict[str, tuple[int, int]]) -> None:
+        self.windows = {name: RingWindow(span, bucket) for name, (span, bucket) in windows.items()}
+        self.last_seen = 0.0
+
+
+class UserWindows:
+    # rolling per-updater tag edit counts, so behaviour spread over several scans still adds up
+
+    def __init__(self, windows: dict[str, tuple[int, int]] | None = None, max_users: int = 50_000) -> None:
+        self.windows = windows or DEFAULT_WINDOWS
+        self.longest = max(span for span, _ in self.windows.values())
+        self.max_users = max_users
+        self.users: OrderedDict[int, UserActivity] = OrderedDict()
+        self.now = 0.0
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def record(self, user_id: int, timestamp: float, removed_tags: int, added_tags: int) -> None:
+        if (activity := self.users.get(user_id)) is None:
+            activity = self.users[user_id] = UserActivity(self.windows)
+        self.users.move_to_end(user_id)
+
+        values = (1, int(removed_tags > 0), removed_tags, added_tags)
+        for window in activity.windows.values():
+            window.add(timestamp, values)
+        activity.last_seen = max(activity.last_seen, timestamp)
+        self.now = max(self.now, timestamp)
+
+        if len(self.users) > self.max_users:
+            self.users.popitem(last=False)
+
+    def totals(self, user_id: int, window: str) -> WindowTotals:
+        if (activity := self.users.get(user_id)) is None:
+            return WindowTotals()
+        ring = activity.windows[window]
+        ring.advance(self.now)
+        return ring.read()
+
+    def evict(self) -> None:
+        # users are kept in last-seen order, so the idle ones are all at the front
+        while self.users:
+            user_id, activity = next(iter(self.users.items()))
+            if activity.last_seen >= self.now - self.longest:
+                break
+            del self.users[user_id]
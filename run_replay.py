@@ -0,0 +1,4 @@
+from danbooru_vandalism_watch.replay import main
+
+if __name__ == "__main__":
+    main()